@@ -1,17 +1,30 @@
+import os
 import sys
-import mss
-import numpy as np
-import cv2
 from PyQt6.QtWidgets import (
-    QApplication, QWidget, QVBoxLayout, QPushButton, QLabel, QComboBox, QLineEdit, QGroupBox, QHBoxLayout, QFrame, QMessageBox, QStyledItemDelegate, QSizePolicy, QGridLayout
+    QApplication, QWidget, QVBoxLayout, QPushButton, QLabel, QComboBox, QLineEdit, QGroupBox, QHBoxLayout, QFrame, QMessageBox, QStyledItemDelegate, QSizePolicy, QGridLayout, QCheckBox, QInputDialog
 )
 from PyQt6.QtGui import QPixmap, QImage, QStandardItem, QStandardItemModel
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QRect, QSize, QTimer
-from pynput import mouse
+from PyQt6.QtCore import Qt, QThread, pyqtSignal, QRect, QSize, QTimer, QEvent
 import time
 import json
-
-from utils import load_model, resource_path
+import functools
+import importlib
+import itertools
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import resource_path, download_model, TileBatchBuffer, to_display_rgb, side_by_side, extract_tiles
+from model_registry import ModelRegistry
+from screen_capture import ScreenCaptureProducer
+from pipeline import DropOldestQueue, StageWorker, Mailbox
+from scheduler import FrameScheduler
+from tile_cache import TileCache, SharedTiles
+from frame_change import FrameChangeDetector
+from pan_tracker import PanTracker
+from regions import union_region, crop_regions
+from frame_stats import FrameStats
+from frame_recorder import FrameRecorder, ReplaySource
+from quantize import PRECISIONS
 
 dropdown_categories = [
     ("▶️ Classification Models", [
@@ -24,53 +37,369 @@ dropdown_categories = [
     ]),
 ]
 
+# Memory cap for cached per-tile model outputs (shared by all models, see tile_cache.py)
+TILE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Loaded models are kept in memory (see model_registry.py) so switching models / restarting is instant.
+# Least recently used models are unloaded once their weights add up to more than this.
+MODEL_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+# Download every model in the dropdown in the background when the app starts, then load the selected one
+PREFETCH_MODELS_ON_STARTUP = True
+
+# Frames whose mean absolute pixel difference (0-255) to the last inferred frame is at or below this are treated as
+# unchanged and the previous result is re-emitted. Raise it if frames with only tiny changes still get inferred.
+CHANGE_THRESHOLD = 1.0
+
+# Move the tile grid along with the slide when the viewer is panned (see pan_tracker.py), so tiles that were already
+# on screen come out of the tile cache and only the newly exposed strips are inferred
+FOLLOW_PANS = True
+
+# Number of preallocated capture buffers. Each frame in flight through the pipeline holds one, and the capture
+# thread waits for a free one when they are all in use (bounds memory for large capture regions).
+CAPTURE_RING_SIZE = 5
+# Fastest the capture thread grabs the screen. Below that it follows the frame rate scheduler (slowing down while
+# the scheduler is idle or paused).
+CAPTURE_MAX_FPS = 30
+
+# Frame rate scheduling (see scheduler.py). The mode and target FPS are picked in the GUI next to Start/Stop.
+# The scheduler backs off while the app uses more than CPU_CEILING of the machine's total CPU, and polls slowly
+# once the captured region has not changed for IDLE_TIMEOUT seconds (or while the window is minimized).
+CPU_CEILING = 0.8
+IDLE_TIMEOUT = 5.0
+
+# Size of the "Inference Output" image. Frames are downscaled to fit (and converted to RGB) on the worker thread.
+DISPLAY_SIZE = 400
+
+# Per-stage timings of every displayed frame (see frame_stats.py): rolling p50/p95 and FPS are shown under the
+# result, computed over the last STATS_WINDOW frames. Set STATS_LOG_PATH to a .csv or .jsonl file to also log them.
+STATS_WINDOW = 120
+STATS_LOG_PATH = None
+
+# Record-and-replay (see frame_recorder.py), e.g. to reproduce a slow session from the field on a dev box.
+# RECORD_DIR: every captured frame (+ timestamp and region) is saved to a new subfolder of it, per Start.
+# REPLAY_PATH: a recording to feed through the pipeline instead of the screen, at 'original' or 'max' speed.
+RECORD_DIR = os.environ.get('REALTIME_GUI_RECORD')
+RECORD_MAX_BYTES = 4 * 1024 * 1024 * 1024
+REPLAY_PATH = os.environ.get('REALTIME_GUI_REPLAY')
+REPLAY_SPEED = os.environ.get('REALTIME_GUI_REPLAY_SPEED', 'original')
+
+# Address ('host:port') of an inference server (see inference_server.py) that owns the models. When set, models are
+# loaded there instead of in this process, and tile batches are sent to it (shared by every window that uses it).
+INFERENCE_SERVER = os.environ.get('REALTIME_GUI_SERVER')
+
 
 
 ########################################################################
 
 
-# Mapping of model name to metadata data
+# Mapping of model name to metadata data. Each metadata file is only read the first time its model is needed
 model_to_info = {}
-for _, _v in dropdown_categories:
-    for __v in _v:
-        with open(resource_path(__v['info_file'])) as f:
-            model_to_info[__v['name']] = json.load(f)
 
-
-# Worker thread for continuous image classification
+def get_model_info(model_name):
+    if model_name not in model_to_info:
+        info_file = next(m['info_file'] for _, models in dropdown_categories for m in models if m['name'] == model_name)
+        with open(resource_path(info_file)) as f:
+            model_to_info[model_name] = json.load(f)
+        model_to_info[model_name]['info_file'] = os.path.basename(info_file)  # What the inference server loads it by
+    return model_to_info[model_name]
+
+
+def registry_key(model_name):
+    # Each precision of a model (metadata "precision", picked in the GUI, see quantize.py) is a separate loaded model
+    return model_name, get_model_info(model_name).get('precision', 'fp32')
+
+
+# Worker thread for continuous image classification.
+# Runs as a pipeline: [capture + prepare] (this thread) -> [infer] -> [render + emit], with 1-slot drop-oldest
+# queues in between, so frame N+1 is grabbed/tiled while frame N is inferred and N-1 is rendered.
+# Several models can run on the same capture: the frame is grabbed, change-checked and tiled once (per tile size),
+# and the models infer it concurrently on a thread pool (ONNX Runtime and torch release the GIL while they run).
+# Several named regions can be captured too (see regions.py): their union is grabbed once, and each model gets the
+# tiles of every region in one batched pass (the backends' infer_regions), results are reported per region.
+# Results reach the GUI through a single-slot mailbox (latest frame wins): frame_ready is only emitted when the
+# mailbox was empty, so a GUI thread that falls behind skips stale frames instead of queueing them up.
 class ClassificationThread(QThread):
-    update_image = pyqtSignal(np.ndarray, str)
+    frame_ready = pyqtSignal()
+    failed = pyqtSignal(str)  # error message, when the pipeline stops on an error
 
-    def __init__(self, ui_instance, model_name):
+    def __init__(self, ui_instance, model_names):
         super().__init__()
         self.ui_instance = ui_instance # So that fields from the UI can be updated and used here in real-time
-        self.model_name = model_name
+        self.model_names = model_names  # The first one is the model selected in the dropdown (its configs are the UI's)
         self.running = True
 
-        res = load_model(model_to_info[model_name])
-        self.model = res['model']
-        self.process_region = res['process_region_func']
-        self.using_gpu = res['using_gpu']
-
-        self.metadata = model_to_info[model_name]
+        self.models = []
+        self.pinned = []  # Registry keys of the models, pinned (never evicted) until the thread stops
+        for model_name in model_names:
+            try:
+                res = ui_instance.model_registry.get(registry_key(model_name), get_model_info(model_name), pin=True)  # Reuses the warm model if already loaded
+            except Exception:
+                self._unpin_models()
+                raise
+            self.pinned.append(registry_key(model_name))
+            metadata = get_model_info(model_name)
+            prepare, infer, render = res['pipeline_funcs']
+            backend = importlib.import_module(res['process_region_func'].__module__)
+            self.models.append({
+                'name': model_name, 'metadata': metadata, 'model': res['model'], 'using_gpu': res['using_gpu'],
+                'pool': res.get('pool'),  # Worker processes, if the model's metadata asks for them
+                'prepare': prepare, 'infer': infer, 'render': render, 'infer_regions': backend.infer_regions,
+                'input_buffer': TileBatchBuffer(),  # Model input buffer reused by every frame (only touched by this model's infer)
+                'default_configs': {k: str(v) for k, v in metadata['additional_configs'].items()},
+            })
+        self.using_gpu = any(m['using_gpu'] for m in self.models)
+        self.tile_sizes = sorted({m['metadata']['tile_size'] for m in self.models})
+        self.executor = ThreadPoolExecutor(max_workers=len(self.models)) if len(self.models) > 1 else None
+
+        self.change_detector = FrameChangeDetector(threshold=CHANGE_THRESHOLD)
+        self.pan_trackers = {}  # Region name -> PanTracker (if FOLLOW_PANS), each region pans on its own
+        self.scheduler = FrameScheduler(cpu_ceiling=CPU_CEILING, idle_timeout=IDLE_TIMEOUT)
+        self.last_output = None  # (display image, result) of the last rendered frame
+        self.display = Mailbox()  # (display image, result, frame timings or None) for the GUI, see ImageClassificationApp.update_display
 
     def run(self):
-        while self.running:
-            start = time.time()
+        release = lambda item: item['captured'].release()
+
+        # A replay hands every frame on (blocking puts) rather than skipping frames the models can't keep up with
+        infer_queue = DropOldestQueue(maxsize=1, on_drop=release, block=bool(REPLAY_PATH))
+        render_queue = DropOldestQueue(maxsize=1, on_drop=release, block=bool(REPLAY_PATH))
+        stages = [
+            StageWorker('infer', self._infer_stage, infer_queue, render_queue, on_error=release),
+            StageWorker('render', self._render_stage, render_queue, on_error=release),
+        ]
+        for stage in stages:
+            stage.start()
+
+        if REPLAY_PATH:
+            self.capture = ReplaySource(REPLAY_PATH, speed=REPLAY_SPEED).start()
+        else:
+            self.capture = ScreenCaptureProducer(self.ui_instance.selected_region, ring_size=CAPTURE_RING_SIZE,
+                                                 max_fps=CAPTURE_MAX_FPS).start()
+
+        recorder = None
+        if RECORD_DIR:
+            recorder = FrameRecorder(os.path.join(RECORD_DIR, time.strftime('%Y%m%d-%H%M%S')), max_bytes=RECORD_MAX_BYTES)
+
+        last_configs = None
+        last_regions = None
+        replay_finished = False
+        try:
+            while self.running:
+                # A failed stage shuts its queues down: stop here too instead of feeding a dead pipeline
+                for stage in stages:
+                    if stage.error is not None:
+                        raise stage.error
+
+                loop_start = time.perf_counter()
+                self.scheduler.configure(self.ui_instance.rate_mode_dropdown.currentText(), self.ui_instance.target_fps_input.text())
+
+                # One read of the GUI's selection per frame: the grab, the crops and the batching all use it
+                selected_region, regions = self.ui_instance.region_selection  # regions: {name: region} inside selected_region, or {} for all of it
+                self.capture.set_region(selected_region)
+                interval = self.scheduler.interval()  # No faster than the frames are taken (idle or paused included)
+                self.capture.set_max_fps(min(CAPTURE_MAX_FPS, 1 / interval) if interval else CAPTURE_MAX_FPS)
+                captured = self.capture.latest(timeout=1.0)
+                if captured is None:
+                    if self.capture.error is not None:
+                        raise self.capture.error
+                    if getattr(self.capture, 'finished', False):
+                        replay_finished = True  # End of the replayed recording
+                        break
+                    continue
+
+                if recorder is not None:
+                    recorder.write(captured, selected_region)
+
+                additional_configs = {
+                    label: input_field.text()
+                    for label, input_field in self.ui_instance.additional_config_inputs.items()
+                }
+
+                # Re-emit the previous result (without touching the model) if nothing changed on screen
+                if additional_configs != last_configs or regions != last_regions:
+                    self.change_detector.reset()
+                    self.pan_trackers = {}
+                if not self.change_detector.has_changed(captured.bgr, can_skip=self.last_output is not None):
+                    captured.release()
+                    image, result = self.last_output
+                    self._post(image, result + self._status_text(), None)
+                    time.sleep(self.scheduler.wait_time(False, loop_start))
+                    continue
+                last_configs = additional_configs
+                last_regions = regions
+
+                item = {'captured': captured, 'timings': {'capture': captured.grab_seconds}}
+                try:
+                    stage_start = time.perf_counter()
+                    self._prepare(item, captured.bgr, additional_configs, regions)
+                    item['timings']['preprocess'] = time.perf_counter() - stage_start
+                except Exception:
+                    captured.release()
+                    raise
+                self.scheduler.report_stage_time('prepare', time.perf_counter() - loop_start)
+                infer_queue.put(item)
+
+                time.sleep(self.scheduler.wait_time(True, loop_start))
+        except Exception as e:
+            traceback.print_exc()
+            self.failed.emit(f'{type(e).__name__}: {e}')
+        finally:
+            # At the end of a replay the stages finish the frames still in flight, otherwise they are dropped
+            infer_queue.close(drain=replay_finished)
+            if not replay_finished:
+                render_queue.close()
+            for stage in stages:
+                stage.join()
+            self.capture.stop()
+            if recorder is not None:
+                recorder.close()
+            if self.executor is not None:
+                self.executor.shutdown()
+            self._unpin_models()
+
+    def _unpin_models(self):
+        for key in self.pinned:
+            self.ui_instance.model_registry.unpin(key)
+        self.pinned = []
+
+    def _map(self, fn, *iterables):
+        # One call per model, on the thread pool when there are several
+        if self.executor is None:
+            return list(map(fn, *iterables))
+        return list(self.executor.map(fn, *iterables))
+
+    def _prepare(self, item, frame, additional_configs, regions):
+        """
+        Fills the item with, per model: the kwargs and prepared state of each region ('kwargs', 'states') and the
+        kwargs to infer all the regions at once with ('batch_kwargs'). Every region is tiled once per tile size,
+        into one list of tiles per tile size (see tile_cache.SharedTiles).
+        """
+        crops = crop_regions(frame, union_region(regions.values()), regions) if regions else {None: frame}
+
+        origins = {}  # Region name -> {tile size: grid origin}
+        for name, crop in crops.items():
+            if FOLLOW_PANS:
+                origins[name] = self.pan_trackers.setdefault(name, PanTracker()).update(crop, self.tile_sizes)
+            else:
+                origins[name] = {tile_size: (0, 0) for tile_size in self.tile_sizes}
+
+        shared = {}  # Tile size -> (SharedTiles of every region, [SharedTiles part of each region])
+        if len(self.models) > 1 or len(crops) > 1:
+            for tile_size in self.tile_sizes:
+                region_slices = []
+                for name, crop in crops.items():
+                    origin_y, origin_x = origins[name][tile_size]
+                    region_slices.append(extract_tiles(crop[origin_y:, origin_x:], tile_size))
+                tiles = SharedTiles([s for slices in region_slices for s in slices])
+                bounds = list(itertools.accumulate((len(slices) for slices in region_slices), initial=0))
+                shared[tile_size] = (tiles, [tiles.part(start, end) for start, end in zip(bounds, bounds[1:])])
+
+        item['regions'] = list(crops)
+        item['kwargs'], item['states'], item['batch_kwargs'] = [], [], []
+        for i, m in enumerate(self.models):
+            tile_size = m['metadata']['tile_size']
+            tiles, parts = shared.get(tile_size, (None, [None] * len(crops)))
+            base = {'model': m['model'], 'metadata': m['metadata'],
+                    'additional_configs': additional_configs if i == 0 else m['default_configs'],
+                    'cache': self.ui_instance.tile_cache, 'input_buffer': m['input_buffer'], 'pool': m['pool']}
+            region_kwargs = [dict(base, grid_origin=origins[name][tile_size], shared_tiles=part)
+                             for name, part in zip(crops, parts)]
+            item['kwargs'].append(region_kwargs)
+            item['states'].append([m['prepare'](crop, **kwargs) for crop, kwargs in zip(crops.values(), region_kwargs)])
+            item['batch_kwargs'].append(dict(base, shared_tiles=tiles))
+
+    def _infer(self, m, states, region_kwargs, batch_kwargs):
+        # One model, every region
+        if len(states) == 1:
+            return [m['infer'](states[0], **region_kwargs[0])]
+        return m['infer_regions'](states, **batch_kwargs)
+
+    def _infer_stage(self, item):
+        stage_start = time.perf_counter()
+        item['states'] = self._map(self._infer, self.models, item['states'], item['kwargs'], item['batch_kwargs'])
+        item['timings']['inference'] = time.perf_counter() - stage_start
+        self.scheduler.report_stage_time('infer', item['timings']['inference'])
+        return item
+
+    def _render_stage(self, item):
+        stage_start = time.perf_counter()
+        # [model][region] -> (frame, text)
+        outputs = self._map(lambda m, states, region_kwargs: [m['render'](state, **kwargs)
+                                                              for state, kwargs in zip(states, region_kwargs)],
+                            self.models, item['states'], item['kwargs'])
+
+        # Downscaled RGB copy for the GUI (frame may be a view into the capture ring buffer). With several models or
+        # regions, the frames the models annotated (e.g. segmentation overlays) are shown side by side, per region.
+        if len(outputs) == 1 and len(item['regions']) == 1:
+            frame, result = outputs[0][0]
+            image = to_display_rgb(frame, DISPLAY_SIZE)
+        else:
+            images, result = [], ''
+            for r, region in enumerate(item['regions']):
+                frames = [outputs[i][r][0] for i in range(len(self.models))
+                          if outputs[i][r][0] is not item['states'][i][r]['frame']]
+                images += [to_display_rgb(frame, DISPLAY_SIZE) for frame in frames or [outputs[0][r][0]]]
+                for m, model_outputs in zip(self.models, outputs):
+                    header = ' / '.join(name for name in (region, m['name'] if len(self.models) > 1 else None) if name)
+                    result += '\n[{}]\n{}'.format(header, model_outputs[r][1].rstrip('\n'))
+            image = side_by_side(images)
+        captured = item['captured']
+        captured.release()
+
+        result += '\n({})'.format(self.ui_instance.tile_cache.summary())
+        self.last_output = (image, result)
+
+        item['timings']['postprocess'] = time.perf_counter() - stage_start
+        self.scheduler.report_stage_time('render', item['timings']['postprocess'])
+
+        frame_info = {'seq': captured.seq, 'captured_at': captured.timestamp, 'timings': item['timings'],
+                      'posted_at': time.perf_counter()}
+        self._post(image, result + self._status_text(), frame_info)
+
+    def _post(self, image, result, frame_info):
+        # frame_info: where the frame's timings come from (None when re-showing the last result)
+        if self.display.post((image, result, frame_info)):
+            self.frame_ready.emit()
+
+    def _status_text(self):
+        text = '\n({})\n({})'.format(self.change_detector.summary(), self.scheduler.summary())
+        for name, pan_tracker in list(self.pan_trackers.items()):
+            text += '\n({}{})'.format(f'{name}: ' if name else '', pan_tracker.summary())
+        return text
+
+    def stop(self):
+        self.running = False
 
-            additional_configs = {
-                label: input_field.text()
-                for label, input_field in self.ui_instance.additional_config_inputs.items()
-            }
 
-            frame, result = self.process_region(self.ui_instance.selected_region, **{'model': self.model, 'metadata': self.metadata, 'additional_configs': additional_configs})
-            result += '\n({:.2f} sec)'.format(time.time() - start)
+# Worker thread that downloads/loads models into the registry, so the GUI never freezes while a model loads.
+# Every model in `download` is downloaded and checked, then every model in `warm` is loaded (and warmed up).
+class ModelLoaderThread(QThread):
+    status = pyqtSignal(str, str)  # model name, what is being done ('Downloading', 'Loading', ...)
+    loaded = pyqtSignal(str)  # model name
+    failed = pyqtSignal(str, str)  # model name, error message
 
-            self.update_image.emit(frame, result)
-            time.sleep(0.1)  # Adjust refresh rate as needed
+    def __init__(self, registry, download=(), warm=()):
+        super().__init__()
+        self.registry = registry
+        self.download = list(download)
+        self.warm = list(warm)
 
-    def stop(self):
-        self.running = False
+    def run(self):
+        for model_name in self.download:
+            try:
+                self.status.emit(model_name, 'Downloading')
+                download_model(get_model_info(model_name))
+            except Exception as e:
+                self.failed.emit(model_name, str(e))
+
+        for model_name in self.warm:
+            try:
+                self.registry.get(registry_key(model_name), get_model_info(model_name),
+                                  progress=lambda status, name=model_name: self.status.emit(name, status))
+                self.loaded.emit(model_name)
+            except Exception as e:
+                self.failed.emit(model_name, str(e))
 
 
 # GUI Application
@@ -78,10 +407,36 @@ class ImageClassificationApp(QWidget):
     def __init__(self):
         super().__init__()
         self.additional_config_inputs = {}  # label -> QLineEdit reference
-        self.selected_region = None
+        # (selected region, {name: region} when several regions are captured, their union being the selected region).
+        # Always replaced as a whole, so the running thread gets a consistent pair from a single read.
+        self.region_selection = (None, {})
+        self.tile_cache = TileCache(max_bytes=TILE_CACHE_MAX_BYTES)  # Kept across Start/Stop and model switches
+        if INFERENCE_SERVER:
+            from inference_server import connect_model
+            self.model_registry = ModelRegistry(max_bytes=MODEL_CACHE_MAX_BYTES,
+                                                loader=functools.partial(connect_model, address=INFERENCE_SERVER))
+        else:
+            self.model_registry = ModelRegistry(max_bytes=MODEL_CACHE_MAX_BYTES)
 
-        self.initUI()
         self.thread = None
+        self.loader_threads = []  # Running ModelLoaderThreads (kept referenced until they finish)
+        self.pending_models = None  # Models that Start was pressed for, while some of them are still loading
+        self.loading_models = set()  # Those of them that are still loading
+        self.display_size = None  # (width, height) of the image currently shown
+        self.frame_stats = None  # FrameStats of the running ClassificationThread
+        self.stats_shown_at = 0.0
+
+        self.initUI()
+
+        if REPLAY_PATH:
+            # No region to pick, frames come from the recording
+            self.region_selection = (ReplaySource(REPLAY_PATH).region, {})
+            self.region_label.setText(f"Replaying:\n{REPLAY_PATH}\n({REPLAY_SPEED} speed)")
+            self.add_region_btn.setEnabled(False)
+            self.start_btn.setEnabled(True)
+
+        if PREFETCH_MODELS_ON_STARTUP:
+            QTimer.singleShot(1000, self.prefetch_models)  # Once the window is up, so it doesn't slow down startup
 
 
     def initUI(self):
@@ -167,7 +522,21 @@ class ImageClassificationApp(QWidget):
 
 
 
-        model_group.setLayout(model_layout)
+        ### Other models to run on the same capture (see ClassificationThread)
+
+        self.also_run_checkboxes = {}  # model name -> QCheckBox
+        also_run_layout = QVBoxLayout()
+        also_run_layout.addWidget(QLabel("Also run:"))
+        for _, models in dropdown_categories:
+            for m in models:
+                checkbox = QCheckBox(m['name'])
+                also_run_layout.addWidget(checkbox)
+                self.also_run_checkboxes[m['name']] = checkbox
+
+        model_group_layout = QVBoxLayout()
+        model_group_layout.addLayout(model_layout)
+        model_group_layout.addLayout(also_run_layout)
+        model_group.setLayout(model_group_layout)
         main_layout_l.addWidget(model_group)
 
 
@@ -203,6 +572,11 @@ class ImageClassificationApp(QWidget):
         self.select_region_btn.clicked.connect(self.select_screen_region)
         capture_layout.addWidget(self.select_region_btn)
 
+        # Button to add another (named) region, captured and inferred together with the others (see regions.py)
+        self.add_region_btn = QPushButton("Add Region", self)
+        self.add_region_btn.clicked.connect(lambda: self.select_screen_region(add=True))
+        capture_layout.addWidget(self.add_region_btn)
+
         # Label to show selected screen region coordinates
         self.region_label = QLabel("Selected Region: NOT SET", self)
         self.region_label.setStyleSheet("QLabel { color: grey; }")
@@ -237,17 +611,52 @@ class ImageClassificationApp(QWidget):
 
         from custom_widgets.PulsingDot import PulsingDot
         self.using_gpu_icon = PulsingDot(color="grey")
-        label = QLabel("Using GPU")
-        label.setStyleSheet("QLabel { margin-top: -3px;  }")  # Need-to to align with dot...
+        self.using_gpu_label = QLabel("Using GPU")
+        self.using_gpu_label.setStyleSheet("QLabel { margin-top: -3px;  }")  # Need-to to align with dot...
 
         status_layout.addWidget(self.using_gpu_icon)
-        status_layout.addWidget(label)
+        status_layout.addWidget(self.using_gpu_label)
 
         classify_layout.addWidget(status_widget)
 
         ####
 
 
+        # Frame rate mode + target (read live by the running thread)
+        rate_widget = QWidget()
+        rate_layout = QHBoxLayout(rate_widget)
+        rate_layout.setContentsMargins(0, 0, 0, 0)
+
+        self.rate_mode_dropdown = QComboBox(self)
+        self.rate_mode_dropdown.addItems(FrameScheduler.MODES)
+        self.rate_mode_dropdown.currentTextChanged.connect(
+            lambda mode: self.target_fps_input.setEnabled(mode != 'Max speed'))
+        self.target_fps_input = QLineEdit("10")
+        self.target_fps_input.setFixedWidth(50)
+
+        rate_layout.addWidget(QLabel("Frame rate:"))
+        rate_layout.addWidget(self.rate_mode_dropdown)
+        rate_layout.addWidget(self.target_fps_input)
+        rate_layout.addWidget(QLabel("FPS"))
+
+        classify_layout.addWidget(rate_widget)
+
+        # Precision of the selected model (stored in its metadata, see quantize.py)
+        precision_widget = QWidget()
+        precision_layout = QHBoxLayout(precision_widget)
+        precision_layout.setContentsMargins(0, 0, 0, 0)
+
+        self.precision_dropdown = QComboBox(self)
+        self.precision_dropdown.addItems(PRECISIONS)
+        self.precision_dropdown.setCurrentText(get_model_info(self.model_dropdown.currentText()).get('precision', 'fp32'))
+        self.precision_dropdown.currentTextChanged.connect(
+            lambda precision: get_model_info(self.model_dropdown.currentText()).__setitem__('precision', precision))
+
+        precision_layout.addWidget(QLabel("Precision:"))
+        precision_layout.addWidget(self.precision_dropdown)
+
+        classify_layout.addWidget(precision_widget)
+
         # Button to start classification
         self.start_btn = QPushButton("Start", self)
         self.start_btn.clicked.connect(self.start_classification)
@@ -283,6 +692,11 @@ class ImageClassificationApp(QWidget):
         self.result_label = QLabel("Result:")
         display_layout.addWidget(self.result_label)
 
+        # Rolling per-stage timings (see frame_stats.py)
+        self.stats_label = QLabel("")
+        self.stats_label.setStyleSheet("QLabel { font-family: monospace; font-size: 11px; color: grey; }")
+        display_layout.addWidget(self.stats_label)
+
         display_group.setLayout(display_layout)
         main_layout_r.addWidget(display_group)
 
@@ -318,8 +732,8 @@ class ImageClassificationApp(QWidget):
 
         self.setFocus() # Prevents any textboxes from getting auto-focused when the application first starts
 
-    def select_screen_region(self):
-
+    def select_screen_region(self, add=False):
+        """Picks a region with two clicks (add: keep the regions picked so far and capture this one too, by name)"""
 
         def get_scaling_factor():
             import platform
@@ -339,6 +753,7 @@ class ImageClassificationApp(QWidget):
 
         def get_mouse_position():
             """Get the current mouse position using pynput."""
+            from pynput import mouse
             pos = []
 
             def on_click(x, y, button, pressed):
@@ -354,76 +769,215 @@ class ImageClassificationApp(QWidget):
         x1, y1 = get_mouse_position()
         x2, y2 = get_mouse_position()
 
-        self.selected_region = {
+        region = {
             "left": min(x1, x2),
             "top": min(y1, y2),
             "width": abs(x1-x2),
             "height": abs(y1-y2)
         }
 
-        print(f"Selected region: {self.selected_region}")
-
+        print(f"Selected region: {region}")
+
+        if add and self.selected_region is not None:
+            regions = dict(self.capture_regions or {"Region 1": self.selected_region})
+            default_name = next(f"Region {i}" for i in itertools.count(len(regions) + 1) if f"Region {i}" not in regions)
+            name, ok = QInputDialog.getText(self, "Add Region", "Region name:", text=default_name)
+            if not ok:
+                return
+            name = name or default_name
+            if name in regions:
+                QMessageBox.warning(self, "Add Region", f"There already is a region named '{name}'.")
+                return
+            regions[name] = region
+
+            # Replaced, not modified in place (the running thread reads them). Grabbed in one go, see regions.py
+            self.region_selection = (union_region(regions.values()), regions)
+
+            self.region_label.setText("Selected Regions:\n" + "\n".join(
+                f"{name}: {r['width'] * get_scaling_factor():.0f} x {r['height'] * get_scaling_factor():.0f} (px)"
+                for name, r in regions.items()))
+        else:
+            self.region_selection = (region, {})
 
-        # Update the label with selected coordinates
-        # self.region_label.setText(f"Selected Region: ({self.selected_region['left']:.2f}, {self.selected_region['top']:.2f}).\n"
-        self.region_label.setText(f"Selected Region:\n"
-                                  f"Width: {self.selected_region['width'] * get_scaling_factor():.2f} (px)\n"
-                                  f"Height: {self.selected_region['height'] * get_scaling_factor():.2f} (px)")
+            # Update the label with selected coordinates
+            # self.region_label.setText(f"Selected Region: ({self.selected_region['left']:.2f}, {self.selected_region['top']:.2f}).\n"
+            self.region_label.setText(f"Selected Region:\n"
+                                      f"Width: {self.selected_region['width'] * get_scaling_factor():.2f} (px)\n"
+                                      f"Height: {self.selected_region['height'] * get_scaling_factor():.2f} (px)")
 
 
         self.region_label.setStyleSheet("QLabel { color: green; }")
         self.start_btn.setEnabled(True)
 
+    @property
+    def selected_region(self):
+        return self.region_selection[0]
+
+    @property
+    def capture_regions(self):
+        return self.region_selection[1]
+
     def start_classification(self):
-        """Start the classification loop"""
+        """Start the classification loop (once the model is loaded)"""
         if self.selected_region is None:
             self.result_label.setText("Please select a region first!")
             return
 
+        model_names = self.selected_model_names()
 
-        model_name = self.model_dropdown.currentText()
-        self.thread = ClassificationThread(self, model_name)
-        self.thread.update_image.connect(self.update_display)
-        self.thread.start()
+        self.start_btn.setEnabled(False)
+        self.stop_btn.setEnabled(True)
+        self._set_model_selection_enabled(False)
 
-        if self.thread.using_gpu:
-            self.using_gpu_icon.set_color("green")
+        missing = [model_name for model_name in model_names if registry_key(model_name) not in self.model_registry]
+        if missing:
+            self.pending_models = model_names
+            self.loading_models = set(missing)
+            self.load_models(warm=missing)
         else:
-            self.using_gpu_icon.set_color("red")
+            self._start_thread(model_names)
+
+    def selected_model_names(self):
+        """The model selected in the dropdown, then the other models ticked under Also run"""
+        selected = self.model_dropdown.currentText()
+        return [selected] + [model_name for model_name, checkbox in self.also_run_checkboxes.items()
+                             if checkbox.isChecked() and model_name != selected]
+
+    def _set_model_selection_enabled(self, enabled):
+        self.model_dropdown.setEnabled(enabled)
+        self.precision_dropdown.setEnabled(enabled)
+        for checkbox in self.also_run_checkboxes.values():
+            checkbox.setEnabled(enabled)
+
+    def _start_thread(self, model_names):
+        self.thread = ClassificationThread(self, model_names)
+        self.thread.frame_ready.connect(self.update_display)
+        self.thread.failed.connect(self._on_classification_failed)
+        self.frame_stats = FrameStats(window=STATS_WINDOW, log_path=STATS_LOG_PATH)
+        self.thread.start()
 
-        self.start_btn.setEnabled(False)
-        self.stop_btn.setEnabled(True)
-        self.model_dropdown.setEnabled(False)
+        self._update_status_dot()
 
     def stop_classification(self):
-        """Stop the classification thread"""
+        """Stop the classification thread (or cancel starting it if its models are still loading)"""
+        self.pending_models = None
+        self.loading_models = set()
+
         if self.thread:
             self.thread.stop()
             self.thread.wait()
             self.thread = None
+        if self.frame_stats is not None:
+            self.frame_stats.close()
 
         self.start_btn.setEnabled(True)
         self.stop_btn.setEnabled(False)
-        self.model_dropdown.setEnabled(True)
-        self.using_gpu_icon.set_color("grey")
-
-    def update_display(self, frame, result):
-        """Update the GUI with the latest image and classification result"""
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2RGB)
-        height, width, channel = frame.shape
-        bytes_per_line = 3 * width
-        q_image = QImage(frame.data, width, height, bytes_per_line, QImage.Format.Format_RGB888)
-        pixmap = QPixmap.fromImage(q_image)
-
-        self.image_label.setPixmap(pixmap.scaled(400, 400, Qt.AspectRatioMode.KeepAspectRatio))
+        self._set_model_selection_enabled(True)
+        self._update_status_dot()
+
+    def load_models(self, download=(), warm=()):
+        """Downloads/loads models in the background (see ModelLoaderThread)"""
+        loader = ModelLoaderThread(self.model_registry, download=download, warm=warm)
+        loader.status.connect(self._on_model_status)
+        loader.loaded.connect(self._on_model_loaded)
+        loader.failed.connect(self._on_model_failed)
+        loader.finished.connect(lambda: self._on_loader_finished(loader))
+
+        self.loader_threads.append(loader)
+        loader.start()
+
+    def prefetch_models(self):
+        """Downloads every model in the dropdown, then loads the selected one, so pressing Start is instant"""
+        all_models = [m['name'] for _, models in dropdown_categories for m in models]
+        if INFERENCE_SERVER:
+            all_models = []  # The server downloads what it loads
+        self.load_models(download=all_models, warm=[self.model_dropdown.currentText()])
+
+    def _on_model_status(self, model_name, status):
+        self.model_status = f"{status} {model_name}..."
+        self._update_status_dot()
+
+    def _on_model_loaded(self, model_name):
+        if model_name in self.loading_models:
+            self.loading_models.discard(model_name)
+            if not self.loading_models:
+                model_names, self.pending_models = self.pending_models, None
+                self._start_thread(model_names)
+
+    def _on_model_failed(self, model_name, error):
+        print(f"Failed to load {model_name}: {error}")
+        if model_name in self.loading_models:
+            self.stop_classification()
+            QMessageBox.warning(self, "Model Loading Failed", f"Could not load {model_name}:\n\n{error}")
+
+    def _on_classification_failed(self, error):
+        if self.sender() is not self.thread:
+            return  # Already stopped
+        self.stop_classification()
+        QMessageBox.warning(self, "Classification Failed", f"Classification stopped on an error:\n\n{error}")
+
+    def _on_loader_finished(self, loader):
+        self.loader_threads.remove(loader)
+        self._update_status_dot()
+
+    def _update_status_dot(self):
+        """Pulsing orange while models load, otherwise green/red (GPU/CPU) while running and grey when stopped"""
+        if self.loader_threads and (self.thread is None or self.pending_models):
+            self.using_gpu_icon.set_color("orange")
+            self.using_gpu_icon.start_pulse()
+            self.using_gpu_label.setText(getattr(self, 'model_status', "Loading..."))
+            return
+
+        self.using_gpu_icon.stop_pulse()
+        self.using_gpu_label.setText("Using GPU")
+        if self.thread is None:
+            self.using_gpu_icon.set_color("grey")
+        elif self.thread.using_gpu:
+            self.using_gpu_icon.set_color("green")
+        else:
+            self.using_gpu_icon.set_color("red")
+
+    def update_display(self):
+        """Update the GUI with the latest image and classification result (already display-sized RGB, see ClassificationThread)"""
+        latest = self.thread.display.take() if self.thread else None
+        if latest is None:
+            return
+        image, result, frame_info = latest
+
+        paint_start = time.perf_counter()
+        height, width, channel = image.shape
+        q_image = QImage(image.data, width, height, 3 * width, QImage.Format.Format_RGB888)
+        self.image_label.setPixmap(QPixmap.fromImage(q_image))
         self.result_label.setText(f"Result: {result}")
 
-        # For window re-sizing
-        QTimer.singleShot(0, self._finalize_resize)
+        if frame_info is not None and self.frame_stats is not None:
+            timings = frame_info['timings']
+            timings['handoff'] = paint_start - frame_info['posted_at']
+            timings['paint'] = time.perf_counter() - paint_start
+            timings['total'] = time.time() - frame_info['captured_at']
+            self.frame_stats.record(timings, seq=frame_info['seq'])
+
+            if time.perf_counter() - self.stats_shown_at > 0.25:  # Only redraw the table a few times per second
+                self.stats_shown_at = time.perf_counter()
+                self.stats_label.setText(self.frame_stats.summary())
+
+        # For window re-sizing (only needed when the image size changes)
+        if (width, height) != self.display_size:
+            self.display_size = (width, height)
+            QTimer.singleShot(0, self._finalize_resize)
+
+    def changeEvent(self, event):
+        """Pause inference while the window is minimized"""
+        if event.type() == QEvent.Type.WindowStateChange and self.thread:
+            self.thread.scheduler.paused = self.isMinimized()
+        super().changeEvent(event)
 
     def closeEvent(self, event):
-        """Ensure the thread stops when closing the app"""
+        """Ensure the threads stop when closing the app"""
         self.stop_classification()
+        for loader in list(self.loader_threads):
+            loader.wait()
+        self.model_registry.clear()  # Also stops inference worker processes
         event.accept()
 
     def show_model_popup(self):
@@ -431,7 +985,7 @@ class ImageClassificationApp(QWidget):
         selected_model = self.model_dropdown.currentText()
 
         # Get the info text (default message if model not found)
-        info_text = model_to_info[selected_model]['info']
+        info_text = get_model_info(selected_model)['info']
 
         # Create and show the popup
         msg = QMessageBox(self)
@@ -445,7 +999,7 @@ class ImageClassificationApp(QWidget):
 
         selected_model = self.model_dropdown.currentText()
 
-        classes = sorted(model_to_info[selected_model]['classes'])
+        classes = sorted(get_model_info(selected_model)['classes'])
 
         from custom_widgets.TablePopup import TablePopup
         popup = TablePopup(self, items=classes, title="Classes")
@@ -457,7 +1011,7 @@ class ImageClassificationApp(QWidget):
         """Updates UI text based on the selected model."""
         selected_model = self.model_dropdown.currentText()
 
-        tile_size = model_to_info[selected_model]['tile_size']
+        tile_size = get_model_info(selected_model)['tile_size']
 
         res = f'This model was trained on images of size {tile_size} x {tile_size} (px) with 20X magnification.\n'
         res += 'Choosing a screen capture size smaller than these dimensions may result in inaccurate results.\n'
@@ -466,10 +1020,16 @@ class ImageClassificationApp(QWidget):
         # Update label text dynamically
         self.capture_recommendation.setText(f"Recommended Capture Size:\n{res}")
 
+        if hasattr(self, 'precision_dropdown'):  # Not created yet on the first call, from initUI
+            self.precision_dropdown.setCurrentText(get_model_info(selected_model).get('precision', 'fp32'))
+
+        for model_name, checkbox in self.also_run_checkboxes.items():
+            checkbox.setVisible(model_name != selected_model)  # Always runs
+
 
         ################################################
 
-        additional_configs = model_to_info[selected_model]['additional_configs']
+        additional_configs = get_model_info(selected_model)['additional_configs']
 
         def clear_layout(layout):
             while layout.count():
@@ -519,6 +1079,9 @@ class ImageClassificationApp(QWidget):
 
 # Run the application
 if __name__ == "__main__":
+    import multiprocessing
+    multiprocessing.freeze_support()  # Inference worker processes (inference_pool.py) in the PyInstaller build
+
     app = QApplication(sys.argv)
     window = ImageClassificationApp()
     window.show()
@@ -0,0 +1,226 @@
+"""
+Offline batch mode: runs a model over large images / pyramidal TIFF slides from disk, without the GUI.
+
+The image is read in chunks of whole tiles (a run of tiles along one tile row at a time), so only one chunk is ever
+in memory: slides much bigger than RAM are fine. Each chunk goes through the model's own `infer` stage, the same
+code the live app uses. Tiles at the right/bottom edge that would not be whole are skipped, like in the live view.
+
+Outputs, per input image, in --out:
+- <name>.tiles.jsonl: one line per tile (row, col, x, y, blank + the backend's `tile_record`)
+- <name>.summary.json: aggregate over all tiles (the backend's `summarize`, e.g. (+)/(-) cell counts)
+
+Tiles flagged by the model's "blank_filter" (glass, see tile_filter.py) are marked `blank` and left out of the
+aggregate.
+
+Runs are resumable: tiles already in <name>.tiles.jsonl are skipped, so an interrupted run picks up where it
+stopped (rerun the same command).
+
+Reading TIFF slides needs `tifffile` (and `zarr` for compressed/tiled files); other formats are read with OpenCV.
+
+    python batch_process.py metadata/mib_yolo.json slide1.tif slide2.tif --out results/
+    python batch_process.py metadata/tumor_compact_vgg.json export.png --level 1 --chunk-mb 512
+"""
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from utils import load_model, extract_tiles, TileBatchBuffer
+
+
+class SlideReader:
+    """
+    Random access to regions of a (possibly pyramidal) image on disk, as BGR uint8 (like a screen grab).
+    TIFFs are opened lazily (only the requested region's TIFF tiles/strips are decoded), anything else is loaded
+    with OpenCV.
+    """
+
+    def __init__(self, path, level=0):
+        self.path = path
+        self._tif = None
+
+        if path.lower().endswith(('.tif', '.tiff', '.svs', '.ndpi')):
+            import tifffile
+
+            self._tif = tifffile.TiffFile(path)
+            series = self._tif.series[0]
+            page = series.levels[level] if level < len(series.levels) else None
+            if page is None:
+                raise ValueError(f"{path} has {len(series.levels)} pyramid level(s), no level {level}")
+
+            try:
+                import zarr
+                self._array = zarr.open(page.aszarr(), mode='r')
+            except ImportError:
+                self._array = tifffile.memmap(path, series=0, level=level, mode='r')  # Only works for uncompressed files
+            self._rgb = True
+        else:
+            import cv2
+
+            if level:
+                raise ValueError(f"{path} is not pyramidal, --level must be 0")
+            self._array = cv2.imread(path, cv2.IMREAD_COLOR)
+            if self._array is None:
+                raise FileNotFoundError(path)
+            self._rgb = False
+
+        if self._array.ndim == 2:
+            self._array = self._array[..., None]
+        self.height, self.width = self._array.shape[:2]
+
+    def read(self, y, x, height, width):
+        region = np.asarray(self._array[y:y + height, x:x + width])
+        if region.shape[2] == 1:
+            region = np.repeat(region, 3, axis=2)
+        if self._rgb:
+            region = region[..., 2::-1]  # RGB(A) -> BGR
+        return np.ascontiguousarray(region[..., :3])
+
+    def close(self):
+        if self._tif is not None:
+            self._tif.close()
+
+
+def load_done(tiles_path, totals):
+    """
+    Tiles already processed in a previous (interrupted) run: ({(row, col)}, number of blank ones). Their records are
+    added into `totals` as they are read rather than kept, so resuming a huge slide does not hold them all in memory.
+    A half-written last line is cut off so the file can be appended to again.
+    """
+    done = set()
+    n_blank = 0
+    if not os.path.exists(tiles_path):
+        return done, n_blank
+
+    good_size = 0
+    with open(tiles_path, 'rb') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if not line.endswith(b'\n'):
+                break
+            good_size += len(line)
+            if (record['row'], record['col']) not in done:
+                done.add((record['row'], record['col']))
+                n_blank += bool(record.get('blank'))
+                add_to_totals(totals, record)
+
+    if good_size != os.path.getsize(tiles_path):
+        with open(tiles_path, 'r+b') as f:
+            f.truncate(good_size)
+    return done, n_blank
+
+
+def add_to_totals(totals, record):
+    # Sum every list-valued field (e.g. class counts / probabilities) of tissue tiles for the backend's summarize
+    if record.get('blank'):
+        return
+    for key, value in record.items():
+        if isinstance(value, list):
+            totals[key] = np.add(totals[key], value) if key in totals else np.asarray(value)
+
+
+def process_image(path, model_res, metadata, out_dir, level=0, chunk_mb=256, additional_configs=None):
+    """Runs the model over every whole tile of the image at `path` and writes the tile records and the summary"""
+    backend = importlib.import_module(model_res['process_region_func'].__module__)
+    _, infer, _ = model_res['pipeline_funcs']
+    tile_size = metadata['tile_size']
+    kwargs = {'model': model_res['model'], 'metadata': metadata,
+              'additional_configs': additional_configs if additional_configs is not None else metadata['additional_configs'],
+              'input_buffer': TileBatchBuffer(), 'pool': model_res.get('pool')}
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    tiles_path = os.path.join(out_dir, name + '.tiles.jsonl')
+    summary_path = os.path.join(out_dir, name + '.summary.json')
+
+    reader = SlideReader(path, level=level)
+    rows, cols = reader.height // tile_size, reader.width // tile_size
+
+    # Chunk size: tiles per model call, bounded by the float32 model input (the largest buffer per chunk)
+    chunk_tiles = max(1, min(cols, chunk_mb * 1024 ** 2 // (tile_size * tile_size * 3 * 4)))
+
+    totals = {}
+    done, n_done_blank = load_done(tiles_path, totals)
+    if done:
+        print(f"{name}: resuming, {len(done)}/{rows * cols} tiles already done")
+
+    start = time.time()
+    n_new = 0
+    n_new_blank = 0
+    try:
+        with open(tiles_path, 'a') as out:
+            for row in range(rows):
+                for col0 in range(0, cols, chunk_tiles):
+                    n = min(chunk_tiles, cols - col0)
+                    todo = [c for c in range(col0, col0 + n) if (row, c) not in done]
+                    if not todo:
+                        continue
+
+                    strip = reader.read(row * tile_size, col0 * tile_size, tile_size, n * tile_size)
+                    tiles = extract_tiles(strip, tile_size)
+                    state = infer({'slices': [tiles[c - col0] for c in todo]}, **kwargs)
+                    outputs = state['confs'] if 'confs' in state else state['detections']
+
+                    for col, output, blank in zip(todo, outputs, state['blank']):
+                        record = dict({'row': row, 'col': col, 'x': col * tile_size, 'y': row * tile_size,
+                                       'blank': blank}, **backend.tile_record(output, **kwargs))
+                        out.write(json.dumps(record) + '\n')
+                        add_to_totals(totals, record)
+                    out.flush()
+                    n_new += len(todo)
+                    n_new_blank += sum(state['blank'])
+
+                print(f"\r{name}: row {row + 1}/{rows} ({n_new / max(time.time() - start, 1e-9):.1f} tiles/s)",
+                      end='', flush=True)
+    finally:
+        reader.close()
+    print()
+
+    n_tiles = len(done) + n_new
+    n_blank = n_done_blank + n_new_blank
+    summary = dict(backend.summarize({k: v.tolist() for k, v in totals.items()}, n_tiles, n_blank, **kwargs),
+                   image=os.path.abspath(path), level=level, tile_size=tile_size, complete=n_tiles == rows * cols)
+    with open(summary_path, 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('metadata', help='model metadata file (e.g. metadata/mib_yolo.json)')
+    parser.add_argument('images', nargs='+')
+    parser.add_argument('--out', default='batch_results', help='output folder')
+    parser.add_argument('--weights', help='local weights file to use instead of the one in the metadata')
+    parser.add_argument('--level', type=int, default=0, help='pyramid level of TIFF slides (0 = full resolution)')
+    parser.add_argument('--chunk-mb', type=int, default=256, help='memory budget of one chunk of tiles')
+    parser.add_argument('--config', action='append', default=[], metavar='NAME=VALUE',
+                        help="override one of the model's additional_configs (e.g. --config min_conf=0.3)")
+    args = parser.parse_args()
+
+    with open(args.metadata) as f:
+        metadata = json.load(f)
+    if args.weights:
+        metadata = dict(metadata, repo=os.path.abspath(args.weights), repo_src='Local')
+
+    additional_configs = dict(metadata['additional_configs'], **dict(c.split('=', 1) for c in args.config))
+
+    os.makedirs(args.out, exist_ok=True)
+    model_res = load_model(metadata, progress=lambda status: print(f"{status} model..."))
+
+    for path in args.images:
+        summary = process_image(path, model_res, metadata, args.out, level=args.level, chunk_mb=args.chunk_mb,
+                                additional_configs=additional_configs)
+        print(json.dumps(summary, indent=2))
+
+    if model_res.get('pool') is not None:
+        model_res['pool'].close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
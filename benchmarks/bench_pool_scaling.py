@@ -0,0 +1,66 @@
+"""
+Scaling benchmark of the multi-process inference pool (inference_pool.py): tiles/s of one model's infer stage on
+one large frame, in-process (0 workers) and with 1, 2, 4, ... worker processes, on generated stand-in models
+(see bench_process_region.py). Speedup and parallel efficiency are relative to the in-process run.
+
+    python benchmarks/bench_pool_scaling.py
+    python benchmarks/bench_pool_scaling.py --metadata metadata/tumor_compact_vgg.json --size 4096 --workers 0 4 8 16
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from bench_process_region import stand_in_weights, synthetic_frame, REPO
+from utils import load_model, TileBatchBuffer
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    default_workers = [0] + [n for n in (1, 2, 4, 8, 16, 32) if n <= cpus]
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--metadata', default=os.path.join(REPO, 'metadata', 'mib_yolo.json'))
+    parser.add_argument('--size', type=int, default=2048, help='square capture size (px)')
+    parser.add_argument('--workers', type=int, nargs='+', default=default_workers)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    with open(args.metadata) as f:
+        metadata = json.load(f)
+    metadata = dict(metadata, repo=stand_in_weights(metadata), repo_src='Local')
+
+    frame = synthetic_frame(args.size, 0)
+    print('{} on {} CPUs, {}px capture'.format(os.path.basename(args.metadata), cpus, args.size))
+    print('{:>8} {:>10} {:>10} {:>9} {:>11}'.format('workers', 'median ms', 'tiles/s', 'speedup', 'efficiency'))
+
+    base = None
+    for n_workers in args.workers:
+        res = load_model(dict(metadata, inference_workers=n_workers))
+        prepare, infer, _ = res['pipeline_funcs']
+        kwargs = {'model': res['model'], 'metadata': metadata, 'additional_configs': metadata['additional_configs'],
+                  'input_buffer': TileBatchBuffer(), 'pool': res['pool']}
+        state = prepare(frame, **kwargs)
+
+        infer(dict(state), **kwargs)  # Warm-up
+        times = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            infer(dict(state), **kwargs)
+            times.append(time.perf_counter() - start)
+
+        if res['pool'] is not None:
+            res['pool'].close()
+
+        median = statistics.median(times)
+        base = base or median
+        print('{:>8} {:>10.1f} {:>10.1f} {:>8.2f}x {:>10.0f}%'.format(
+            n_workers, median * 1000, len(state['slices']) / median, base / median,
+            base / median / max(n_workers, 1) * 100))
+
+
+if __name__ == '__main__':
+    main()
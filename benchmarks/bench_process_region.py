@@ -0,0 +1,268 @@
+"""
+End-to-end benchmark of the process_region backends, headless: no screen, GPU or HuggingFace access needed.
+
+Every model in metadata/*.json is run through its backend's `process_region` on static frames (passed in with
+`frame=` instead of grabbing the screen), for every capture size in --sizes and the model's own tile_size.
+The real weights are replaced by locally generated stand-ins with the same input/output shapes:
+- ONNX classifiers: a tiny synthetic ONNX graph (mean colour -> linear -> softmax), built with the `onnx` package
+- YOLO: an untrained YOLOv8n-seg with the metadata's classes (needs ultralytics), run with the metadata's engine
+Stand-ins are built once and kept in the app's cache folder. The tile cache is off so every frame is inferred.
+With --replay, the frames of a recording (see frame_recorder.py) are used instead, at their recorded size.
+
+Each configuration runs in a fresh process, and reports per-frame latency percentiles, throughput (tiles/s),
+peak RSS of the process (model + buffers) and peak Python/numpy allocations during one frame (tracemalloc).
+Fails (exit code 1) if a saved baseline is given and a configuration's median latency regressed by more than --tolerance.
+
+    python benchmarks/bench_process_region.py
+    python benchmarks/bench_process_region.py --sizes 1024 4096 --frames 50 --save process_region_baseline.json
+    python benchmarks/bench_process_region.py --images slide1.png slide2.png --baseline process_region_baseline.json
+    python benchmarks/bench_process_region.py --replay recordings/20250101-120000 --metadata metadata/mib_yolo.json
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO)
+
+# Model types (metadata "model") that have a process_region backend
+BACKENDS = ('ONNX', 'YOLO')
+
+
+def synthetic_classifier(tile_size, n_classes):
+    """Path of a tiny ONNX classifier with the real models' interface: (N, H, W, 3) float32 -> (N, n_classes) softmax
+    (H and W are left dynamic so captures smaller than a tile work, as they do with the real models)"""
+    from utils import cache_path
+
+    path = cache_path('benchmarks', 'classifier_{}_{}.onnx'.format(tile_size, n_classes))
+    if os.path.exists(path):
+        return path
+
+    import onnx
+    from onnx import helper, numpy_helper, TensorProto
+
+    weights = np.random.default_rng(0).normal(size=(3, n_classes)).astype(np.float32)
+    graph = helper.make_graph(
+        [
+            helper.make_node('ReduceMean', ['input', 'axes'], ['mean'], keepdims=0),
+            helper.make_node('MatMul', ['mean', 'weights'], ['logits']),
+            helper.make_node('Softmax', ['logits'], ['output'], axis=-1),
+        ],
+        'synthetic_classifier',
+        [helper.make_tensor_value_info('input', TensorProto.FLOAT, ['batch', 'height', 'width', 3])],
+        [helper.make_tensor_value_info('output', TensorProto.FLOAT, ['batch', n_classes])],
+        initializer=[numpy_helper.from_array(np.array([1, 2], dtype=np.int64), 'axes'),
+                     numpy_helper.from_array(weights, 'weights')],
+    )
+    # IR version pinned so older onnxruntime releases can load it too
+    onnx.save(helper.make_model(graph, opset_imports=[helper.make_opsetid('', 18)], ir_version=8), path)
+    return path
+
+
+def synthetic_yolo(n_classes):
+    """Path of an untrained YOLOv8n-seg checkpoint with n_classes classes (same architecture and outputs as a trained one)"""
+    from utils import cache_path
+
+    path = cache_path('benchmarks', 'yolov8n_seg_{}.pt'.format(n_classes))
+    if os.path.exists(path):
+        return path
+
+    import torch
+    from ultralytics.nn.tasks import SegmentationModel
+
+    model = SegmentationModel('yolov8n-seg.yaml', nc=n_classes, verbose=False)
+    torch.save({'model': model.half(), 'train_args': {'task': 'segment'}, 'epoch': -1, 'date': None}, path)
+    return path
+
+
+def stand_in_weights(metadata):
+    """Path of the generated stand-in for a model's weights"""
+    if metadata['model'] == 'ONNX':
+        return synthetic_classifier(metadata['tile_size'], len(metadata['classes']))
+    return synthetic_yolo(len(metadata['classes']))
+
+
+def load_stand_in(metadata):
+    """utils.load_model with the stand-in weights. Returns the loaded model dict"""
+    from utils import load_model
+    return load_model(dict(metadata, repo=stand_in_weights(metadata), repo_src='Local'))  # Absolute path, so taken as is
+
+
+def synthetic_frame(size, seed):
+    """Tissue-like BGR frame: smooth pink/purple blobs on a light background, plus noise"""
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    stain = cv2.resize(rng.random((size // 64 + 2, size // 64 + 2), dtype=np.float32), (size, size),
+                       interpolation=cv2.INTER_CUBIC)[..., None]
+    background, tissue = np.array([235, 230, 240]), np.array([150, 80, 170])
+    frame = background + (tissue - background) * np.clip(stain * 1.5 - 0.25, 0, 1)
+    frame += rng.normal(0, 8, frame.shape)
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+def load_frames(images, size, count=2):
+    """`count` size x size BGR frames: from the given images (tiled/cropped to size), or synthetic"""
+    if not images:
+        return [synthetic_frame(size, seed) for seed in range(count)]
+
+    import cv2
+    frames = []
+    for path in images:
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            raise FileNotFoundError(path)
+        reps = (-(-size // image.shape[0]), -(-size // image.shape[1]), 1)
+        frames.append(np.ascontiguousarray(np.tile(image, reps)[:size, :size]))
+    return frames
+
+
+def peak_rss_mb():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024  # Bytes on macOS, KB on Linux
+    except ImportError:  # Windows
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 1024 ** 2
+
+
+def run_config(config):
+    """Runs one configuration (in this process) and returns its results"""
+    with open(config['metadata_file']) as f:
+        metadata = json.load(f)
+    size, tile_size = config.get('size'), metadata['tile_size']
+
+    if config.get('replay'):
+        from frame_recorder import read_recording, recorded_frame
+        index, store = read_recording(config['replay'])
+        frames = [recorded_frame(entry, store) for entry in index]
+    else:
+        frames = load_frames(config['images'], size)
+    res = load_stand_in(metadata)
+    process_region = res['process_region_func']
+    kwargs = {'model': res['model'], 'metadata': metadata, 'additional_configs': metadata['additional_configs'],
+              'pool': res['pool']}
+    if metadata['model'] == 'ONNX':
+        from utils import TileBatchBuffer
+        kwargs['input_buffer'] = TileBatchBuffer()  # As the app does, reused across frames
+
+    def frame_fn(k):
+        with contextlib.redirect_stdout(io.StringIO()):  # Backends print their results every frame
+            process_region(None, frame=frames[k % len(frames)], **kwargs)
+
+    for k in range(config['warmup']):
+        frame_fn(k)
+
+    latencies = []
+    for k in range(config['frames']):
+        start = time.perf_counter()
+        frame_fn(k)
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    frame_fn(0)
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if res['pool'] is not None:
+        res['pool'].close()
+
+    height, width = frames[0].shape[:2]
+    tiles = (height // min(tile_size, height)) * (width // min(tile_size, width))
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'tiles': tiles,
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p90_ms': float(np.percentile(latencies_ms, 90)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+        'tiles_per_s': tiles * len(latencies) / float(np.sum(latencies)),
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_traced_mb': traced_peak / 1024 ** 2,
+    }
+
+
+def config_name(config):
+    return '{}@{}'.format(os.path.splitext(os.path.basename(config['metadata_file']))[0],
+                          'replay' if config.get('replay') else config['size'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--metadata', nargs='+', default=sorted(glob.glob(os.path.join(REPO, 'metadata', '*.json'))),
+                        help='metadata files of the models to run (default: all)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 1024, 2048], help='square capture sizes (px)')
+    parser.add_argument('--images', nargs='*', default=[], help='images to use as frames (default: synthetic tissue)')
+    parser.add_argument('--replay', help='recording folder to use as frames (instead of --sizes/--images)')
+    parser.add_argument('--frames', type=int, default=20, help='timed frames per configuration')
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--save', help='write the results to this JSON file (e.g. to use as a baseline)')
+    parser.add_argument('--baseline', help='JSON file from --save to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown vs baseline (0.2 = 20%%)')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)  # Internal: run one configuration (JSON) and print its results
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_config(json.loads(args.worker))))
+        return
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print('{:<40} {:>6} {:>9} {:>9} {:>9} {:>10} {:>9} {:>10} | {:>8}'.format(
+        'config', 'tiles', 'p50 ms', 'p90 ms', 'p99 ms', 'tiles/s', 'RSS MB', 'alloc MB', 'vs base'))
+
+    results, failed = {}, False
+    for metadata_file in args.metadata:
+        with open(metadata_file) as f:
+            if json.load(f)['model'] not in BACKENDS:
+                continue
+
+        for size in ([None] if args.replay else args.sizes):
+            config = {'metadata_file': os.path.abspath(metadata_file), 'size': size, 'images': args.images,
+                      'replay': args.replay and os.path.abspath(args.replay), 'frames': args.frames,
+                      'warmup': args.warmup}
+            name = config_name(config)
+
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', json.dumps(config)],
+                                  cwd=REPO, capture_output=True, text=True)
+            if proc.returncode != 0:
+                print('{:<40} FAILED\n{}'.format(name, proc.stderr.strip().splitlines()[-1] if proc.stderr else ''))
+                failed = True
+                continue
+            r = results[name] = json.loads(proc.stdout.strip().splitlines()[-1])
+
+            change = ''
+            if name in baseline:
+                ratio = r['p50_ms'] / baseline[name]['p50_ms']
+                change = '{:+.0f}%'.format((ratio - 1) * 100)
+                if ratio > 1 + args.tolerance:
+                    change += ' FAIL'
+                    failed = True
+
+            print('{:<40} {:>6} {:>9.1f} {:>9.1f} {:>9.1f} {:>10.1f} {:>9.0f} {:>10.1f} | {:>8}'.format(
+                name, r['tiles'], r['p50_ms'], r['p90_ms'], r['p99_ms'], r['tiles_per_s'], r['peak_rss_mb'],
+                r['peak_traced_mb'], change))
+
+    if failed and baseline:
+        print('\nFAIL: median latency regressed by more than {:.0f}% (or a configuration failed)'.format(args.tolerance * 100))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
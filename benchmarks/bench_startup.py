@@ -0,0 +1,146 @@
+"""
+Startup benchmark: import-time breakdown of `import app` and time-to-first-paint of the main window.
+
+Each run is a fresh interpreter (cold imports, same as launching the app). Time-to-first-paint is measured from
+just before the interpreter is launched until the window's first paint event; model prefetching is disabled.
+Fails (exit code 1) if a heavy backend module is imported at startup, or if a saved baseline is given and
+time-to-first-paint regressed by more than --tolerance.
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 10 --save startup_baseline.json
+    python benchmarks/bench_startup.py --baseline startup_baseline.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Must only be imported once their backend is actually used
+HEAVY_MODULES = ['torch', 'ultralytics', 'onnxruntime', 'cv2', 'huggingface_hub', 'mss', 'pynput']
+
+FIRST_PAINT_SCRIPT = '''
+import json, sys, time
+t_start = time.time()
+import app
+t_imported = time.time()
+
+from PyQt6.QtWidgets import QApplication
+from PyQt6.QtCore import QObject, QEvent
+
+app.PREFETCH_MODELS_ON_STARTUP = False
+qt_app = QApplication(sys.argv)
+window = app.ImageClassificationApp()
+t_constructed = time.time()
+
+class FirstPaint(QObject):
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Type.Paint:
+            print(json.dumps({'start': t_start, 'imported': t_imported, 'constructed': t_constructed,
+                              'painted': time.time(), 'modules': sorted(sys.modules)}))
+            qt_app.quit()
+        return False
+
+first_paint = FirstPaint()
+window.installEventFilter(first_paint)
+window.show()
+qt_app.exec()
+'''
+
+
+def import_breakdown():
+    """Top-level modules imported by `import app`, sorted by cumulative import time (ms)"""
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=REPO,
+                         capture_output=True, text=True, check=True).stderr
+
+    rows = []
+    for line in out.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, self_us, cumulative_us, name = [p for p in line.replace('import time:', '|').split('|')]
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((depth, name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000))
+
+    # importtime lists a module's imports right before the module itself, so app's direct imports are the lines
+    # one level deeper just above it
+    app_idx = next(i for i, row in enumerate(rows) if row[1] == 'app')
+    app_depth = rows[app_idx][0]
+    breakdown = [(rows[app_idx][1], rows[app_idx][3])]
+    for depth, name, _, cum in reversed(rows[:app_idx]):
+        if depth <= app_depth:
+            break
+        if depth == app_depth + 1:
+            breakdown.append((name, cum))
+
+    return sorted(breakdown, key=lambda r: -r[1])
+
+
+def first_paint_run():
+    launched = time.time()
+    out = subprocess.run([sys.executable, '-c', FIRST_PAINT_SCRIPT], cwd=REPO, capture_output=True, text=True,
+                         check=True).stdout
+    t = json.loads(out.strip().splitlines()[-1])
+
+    return {
+        'interpreter_ms': (t['start'] - launched) * 1000,
+        'import_app_ms': (t['imported'] - t['start']) * 1000,
+        'build_window_ms': (t['constructed'] - t['imported']) * 1000,
+        'first_paint_ms': (t['painted'] - launched) * 1000,
+    }, [m for m in HEAVY_MODULES if m in t['modules']]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='number of imports to list in the breakdown')
+    parser.add_argument('--save', help='write the results to this JSON file (e.g. to use as a baseline)')
+    parser.add_argument('--baseline', help='JSON file from --save to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown vs baseline (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    print('Import breakdown of `import app` (cumulative ms):')
+    for name, cum in import_breakdown()[:args.top]:
+        print('  {:>8.1f}  {}'.format(cum, name))
+
+    runs, heavy = [], set()
+    for _ in range(args.runs):
+        timings, heavy_loaded = first_paint_run()
+        runs.append(timings)
+        heavy.update(heavy_loaded)
+
+    results = {k: statistics.median(r[k] for r in runs) for k in runs[0]}
+    results['heavy_modules_at_startup'] = sorted(heavy)
+
+    print('\nMedian of {} runs (ms):'.format(args.runs))
+    for k, v in results.items():
+        if k.endswith('_ms'):
+            print('  {:<16} {:>8.1f}'.format(k, v))
+
+    failed = False
+    if heavy:
+        print('\nFAIL: heavy modules imported before first paint: {}'.format(', '.join(sorted(heavy))))
+        failed = True
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        ratio = results['first_paint_ms'] / baseline['first_paint_ms']
+        print('\nfirst_paint_ms vs baseline: {:.1f} -> {:.1f} ({:+.0f}%)'.format(
+            baseline['first_paint_ms'], results['first_paint_ms'], (ratio - 1) * 100))
+        if ratio > 1 + args.tolerance:
+            print('FAIL: time-to-first-paint regressed by more than {:.0f}%'.format(args.tolerance * 100))
+            failed = True
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
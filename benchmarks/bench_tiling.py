@@ -0,0 +1,86 @@
+"""
+Micro-benchmark: tiling + uint8 -> float32 normalization, old vs new.
+
+old: double-loop list of slices -> np.array(slices) -> np.divide(..., 255) (float64) -> .astype(np.float32)
+new: utils.tile_grid strided view -> TileBatchBuffer.fill into a reused float32 buffer
+
+Reports the best wall time and the peak memory allocated during one call (tracemalloc tracks numpy buffers).
+
+    python benchmarks/bench_tiling.py
+    python benchmarks/bench_tiling.py --sizes 2048 4096 --tile-sizes 1024 128
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils import tile_grid, TileBatchBuffer
+
+
+def old_tiles_and_batch(frame, tile_size):
+    slices = []
+    for i in range(frame.shape[0] // tile_size):
+        for j in range(frame.shape[1] // tile_size):
+            slices.append(frame[(i * tile_size):((i * tile_size) + tile_size), (j * tile_size):((j * tile_size) + tile_size), :])
+
+    batch = np.divide(np.array(slices), 255)
+    return batch.astype(np.float32)
+
+
+def new_tiles_and_batch(frame, tile_size, buffer):
+    return buffer.fill(tile_grid(frame, tile_size))
+
+
+def measure(fn, repeats):
+    fn()  # Warm-up (also lets the reusable buffer allocate once, as it would on the first frame)
+
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1024, 2048, 4096], help='square capture sizes (px)')
+    parser.add_argument('--tile-sizes', type=int, nargs='+', default=[1024, 128])
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    print('{:>8} {:>6} {:>6} | {:>10} {:>10} | {:>12} {:>12}'.format(
+        'capture', 'tile', 'tiles', 'old (ms)', 'new (ms)', 'old alloc MB', 'new alloc MB'))
+
+    rng = np.random.default_rng(0)
+    for size in args.sizes:
+        # BGR view of a BGRA buffer, exactly what the capture producer hands out
+        frame = rng.integers(0, 256, (size, size, 4), dtype=np.uint8)[:, :, :3]
+
+        for tile_size in args.tile_sizes:
+            if tile_size > size:
+                continue
+            buffer = TileBatchBuffer()
+
+            old_time, old_peak = measure(lambda: old_tiles_and_batch(frame, tile_size), args.repeats)
+            new_time, new_peak = measure(lambda: new_tiles_and_batch(frame, tile_size, buffer), args.repeats)
+
+            assert np.array_equal(old_tiles_and_batch(frame, tile_size), new_tiles_and_batch(frame, tile_size, buffer))
+
+            print('{:>8} {:>6} {:>6} | {:>10.1f} {:>10.1f} | {:>12.1f} {:>12.1f}'.format(
+                size, tile_size, (size // tile_size) ** 2, old_time * 1000, new_time * 1000,
+                old_peak / 1024 ** 2, new_peak / 1024 ** 2))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,16 +8,23 @@ class PulsingDot(QWidget):
         self._radius = 6
         self._color = QColor(color)
 
-        # Pulse animation
-        # self.anim = QPropertyAnimation(self, b"radius")
-        # self.anim.setDuration(1000)
-        # self.anim.setStartValue(6)
-        # self.anim.setEndValue(10)
-        # self.anim.setLoopCount(-1)
-        # self.anim.start()
+        # Pulse animation (see start_pulse)
+        self.anim = QPropertyAnimation(self, b"radius")
+        self.anim.setDuration(1000)
+        self.anim.setStartValue(4)
+        self.anim.setKeyValueAt(0.5, 8)
+        self.anim.setEndValue(4)
+        self.anim.setLoopCount(-1)
 
         self.setFixedSize(20, 20)  # Space for dot to grow/shrink
 
+    def start_pulse(self):
+        self.anim.start()
+
+    def stop_pulse(self):
+        self.anim.stop()
+        self.set_radius(6)
+
     def set_color(self, color):
         self._color = QColor(color)
         self.update()
@@ -0,0 +1,57 @@
+import numpy as np
+
+
+class FrameChangeDetector:
+    """
+    Cheap "did anything on screen change?" check that runs right after the screen grab.
+
+    Frames are subsampled to roughly `sample_size` px on their longest side and compared to the last frame that
+    was actually sent to the model. A frame counts as unchanged when the mean absolute pixel difference (0-255)
+    is at or below `threshold`. `threshold=0` only skips frames that are pixel-identical on the sampled grid.
+    """
+
+    def __init__(self, threshold=1.0, sample_size=128):
+        self.threshold = threshold
+        self.sample_size = sample_size
+
+        self.frames_seen = 0
+        self.frames_skipped = 0
+        self.last_score = None
+
+        self._reference = None
+
+    @property
+    def skip_ratio(self):
+        return self.frames_skipped / self.frames_seen if self.frames_seen else 0.0
+
+    def _sample(self, frame):
+        step = max(1, max(frame.shape[:2]) // self.sample_size)
+        return frame[::step, ::step, :3].astype(np.int16)
+
+    def reset(self):
+        """Forces the next frame to be treated as changed (e.g. after the region or configs change)"""
+        self._reference = None
+
+    def has_changed(self, frame, can_skip=True):
+        """
+        can_skip=False: the caller has no previous result to show instead, so the frame goes to the model whatever
+        this returns. It then becomes the new reference and is not counted as skipped.
+        """
+        self.frames_seen += 1
+        sample = self._sample(frame)
+
+        if self._reference is None or self._reference.shape != sample.shape:
+            self.last_score = None
+            self._reference = sample
+            return True
+
+        self.last_score = float(np.mean(np.abs(sample - self._reference)))
+        if self.last_score <= self.threshold and can_skip:
+            self.frames_skipped += 1
+            return False
+
+        self._reference = sample
+        return True
+
+    def summary(self):
+        return 'skipped {:.0f}% of frames'.format(self.skip_ratio * 100)
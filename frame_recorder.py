@@ -0,0 +1,149 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from screen_capture import CapturedFrame
+
+
+# A recording is a folder with:
+# - frames.u8: the captured BGR frames, raw uint8, back to back (memory-mapped on replay, so nothing is decoded)
+# - index.jsonl: one line per frame: seq, timestamp, grab_seconds, byte offset + shape in frames.u8, and the region
+FRAMES_FILE = 'frames.u8'
+INDEX_FILE = 'index.jsonl'
+
+
+class FrameRecorder:
+    """
+    Appends captured frames (with their timestamps and the selected region) to a recording folder.
+    Recording stops (silently, `full` is set) once `max_bytes` of frames have been written.
+    """
+
+    def __init__(self, path, max_bytes=4 * 1024 ** 3):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.frames_written = 0
+        self.full = False
+
+        self._frames = open(os.path.join(path, FRAMES_FILE), 'ab')
+        self._index = open(os.path.join(path, INDEX_FILE), 'a')
+        self._offset = self._frames.tell()
+
+    def write(self, captured, region):
+        """captured: a CapturedFrame (its `bgr` is copied out, so it can be released right after)"""
+        if self.full:
+            return
+        frame = np.ascontiguousarray(captured.bgr)
+        if self._offset + frame.nbytes > self.max_bytes:
+            self.full = True
+            print(f"Recording stopped at {self.frames_written} frames ({self.max_bytes / 1024 ** 3:.1f} GB limit)")
+            return
+
+        self._frames.write(frame.data)
+        self._index.write(json.dumps({
+            'seq': captured.seq, 'timestamp': captured.timestamp, 'grab_seconds': captured.grab_seconds,
+            'offset': self._offset, 'shape': list(frame.shape), 'region': region,
+        }) + '\n')
+        self._offset += frame.nbytes
+        self.frames_written += 1
+
+    def close(self):
+        self._frames.close()
+        self._index.close()
+
+
+def read_recording(path):
+    """(index entries, memory-mapped frame store) of a recording folder"""
+    with open(os.path.join(path, INDEX_FILE)) as f:
+        index = [json.loads(line) for line in f if line.strip()]
+    if not index:
+        raise ValueError(f"Empty recording: {path}")
+    frames = np.memmap(os.path.join(path, FRAMES_FILE), dtype=np.uint8, mode='r')
+    return index, frames
+
+
+def recorded_frame(index_entry, frames):
+    """Zero-copy (read-only) view of one recorded frame"""
+    shape = index_entry['shape']
+    return frames[index_entry['offset']:index_entry['offset'] + int(np.prod(shape))].reshape(shape)
+
+
+class ReplaySource:
+    """
+    Plays a recording back through the same interface as `ScreenCaptureProducer` (start/stop/set_region/latest),
+    so it can stand in for the screen grabber anywhere.
+
+    speed='original': frames come out on the recording's own timeline. A consumer slower than the recording
+    skips frames, just like it would with the live screen.
+    speed='max': every frame, in order, as fast as the consumer takes them (deterministic, for A/B runs).
+
+    Once the recording is over, `latest()` returns None and `finished` is set (or it starts over with `loop`).
+    """
+
+    SPEEDS = ('original', 'max')
+
+    def __init__(self, path, speed='original', loop=False):
+        assert speed in self.SPEEDS, speed
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+
+        self.index, self._frames = read_recording(path)
+        self.region = self.index[0]['region']
+        self.frames_grabbed = 0
+        self.finished = False
+        self.error = None
+
+        self._next = 0  # Index of the next frame to hand out
+        self._started_at = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._started_at = time.perf_counter()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def set_region(self, region):
+        pass  # The region is the recorded one
+
+    def set_max_fps(self, max_fps):
+        pass  # The speed is set by `speed`
+
+    def _release(self, generation, slot):
+        pass  # Frames are views of the read-only memory map, nothing to give back
+
+    def _due(self, k):
+        # Seconds after start() at which frame k is due
+        return self.index[k]['timestamp'] - self.index[0]['timestamp']
+
+    def latest(self, wait_new=True, timeout=None):
+        if self._next >= len(self.index):
+            if not self.loop:
+                self.finished = True
+                return None
+            self._next = 0
+            self._started_at = time.perf_counter()
+
+        k = self._next
+        if self.speed == 'original':
+            elapsed = time.perf_counter() - self._started_at
+            while k + 1 < len(self.index) and self._due(k + 1) <= elapsed:
+                k += 1  # Skip frames the consumer was too slow for
+
+            wait = self._due(k) - elapsed
+            if timeout is not None and wait > timeout:
+                self._stopped.wait(timeout)
+                return None
+            if wait > 0 and self._stopped.wait(wait):
+                return None
+
+        self._next = k + 1
+        self.frames_grabbed += 1
+        entry = self.index[k]
+        return CapturedFrame(self, 0, k, entry['seq'], time.time(), recorded_frame(entry, self._frames),
+                             entry['grab_seconds'])
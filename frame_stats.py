@@ -0,0 +1,80 @@
+import csv
+import json
+import time
+from collections import deque
+
+import numpy as np
+
+
+# Per-frame timings, in pipeline order. 'total' is from the screen grab to the end of the GUI update (queueing included)
+STAGES = ('capture', 'preprocess', 'inference', 'postprocess', 'handoff', 'paint', 'total')
+
+
+class FrameStats:
+    """
+    Per-stage timings of the last `window` frames that made it to the screen, for rolling p50/p95 and FPS.
+
+    A frame's timings (stage -> seconds) are collected along the pipeline and `record`ed once it has been painted.
+    With `log_path`, every frame is also appended to a .csv or .jsonl file (by extension, times in ms) for offline analysis.
+    Recording is a few deque appends (plus one buffered line when logging), so it can run on every frame.
+    """
+
+    def __init__(self, window=120, log_path=None):
+        self.window = window
+        self.frames = 0
+
+        self._samples = {stage: deque(maxlen=window) for stage in STAGES}
+        self._times = deque(maxlen=window)  # When each frame was recorded (for FPS)
+
+        self._log = None
+        self._writer = None
+        if log_path:
+            self._log = open(log_path, 'a', newline='')
+            if log_path.endswith('.csv'):
+                self._writer = csv.DictWriter(self._log, fieldnames=('time', 'seq') + STAGES)
+                if self._log.tell() == 0:
+                    self._writer.writeheader()
+
+    def record(self, timings, seq=None):
+        """timings: stage -> seconds (stages that did not run can be left out)"""
+        now = time.time()
+        self.frames += 1
+        self._times.append(now)
+        for stage, seconds in timings.items():
+            self._samples[stage].append(seconds)
+
+        if self._log is not None:
+            row = dict({'time': round(now, 4), 'seq': seq}, **{k: round(v * 1000, 3) for k, v in timings.items()})
+            if self._writer is not None:
+                self._writer.writerow(row)
+            else:
+                self._log.write(json.dumps(row) + '\n')
+
+    @property
+    def fps(self):
+        if len(self._times) < 2:
+            return 0.0
+        return (len(self._times) - 1) / max(self._times[-1] - self._times[0], 1e-9)
+
+    def percentiles(self, stage):
+        """(p50, p95) of a stage in ms, or None if it has no samples yet"""
+        samples = self._samples[stage]
+        if not samples:
+            return None
+        p50, p95 = np.percentile(samples, (50, 95))
+        return p50 * 1000, p95 * 1000
+
+    def summary(self):
+        """Multi-line table of p50/p95 per stage and the FPS (meant for a monospace label)"""
+        lines = ['{:<12}{:>9}{:>9}'.format('stage', 'p50 ms', 'p95 ms')]
+        for stage in STAGES:
+            p = self.percentiles(stage)
+            if p is not None:
+                lines.append('{:<12}{:>9.1f}{:>9.1f}'.format(stage, *p))
+        lines.append('{:.1f} FPS (last {} frames)'.format(self.fps, len(self._times)))
+        return '\n'.join(lines)
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
@@ -0,0 +1,220 @@
+import importlib
+import multiprocessing as mp
+import os
+import sys
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from utils import load_model, TileBatchBuffer
+
+
+def _attach(name):
+    """Opens an existing shared memory block (created, and unlinked in the end, by the parent process)"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        # Spawned workers share the parent's resource tracker, so registering the block again is harmless
+        return shared_memory.SharedMemory(name=name)
+
+
+def batch_views(blocks, in_name, in_shape, out_layout):
+    """(tiles, {field: outputs}) arrays over attached shared memory blocks (name -> SharedMemory), see SharedBatch"""
+    tiles = np.ndarray(in_shape, dtype=np.uint8, buffer=blocks[in_name].buf)
+    outs = {field: np.ndarray((in_shape[0],) + shape, dtype=dtype, buffer=blocks[name].buf)
+            for field, name, shape, dtype in out_layout}
+    return tiles, outs
+
+
+def store_outputs(outs, start, outputs):
+    # Per-tile backend outputs -> the shared output arrays of batch_views, from tile index `start` on
+    for field, out in outs.items():
+        for k, output in enumerate(outputs):
+            out[start + k] = output if field is None else output[field]
+
+
+class SharedBatch:
+    """
+    Shared memory blocks for a batch of tiles and their outputs, on the side that owns them (reused between batches,
+    grown when needed). The other side attaches them by name, using the layout `write` returns.
+    """
+
+    def __init__(self):
+        self._blocks = {}  # Field (or 'tiles') -> SharedMemory
+
+    def _block(self, key, nbytes):
+        shm = self._blocks.get(key)
+        if shm is None or shm.size < nbytes:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            shm = self._blocks[key] = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        return shm
+
+    def write(self, tiles, spec):
+        """
+        Copies the tiles to shared memory and makes room for their outputs (spec: the backend's `tile_output_spec`).
+        Returns (tiles block name, tiles shape, output layout: [(field, block name, shape, dtype)]).
+        """
+        n = len(tiles)
+        in_shape = (n,) + tuple(tiles[0].shape)
+        tiles_shm = self._block('tiles', int(np.prod(in_shape)))
+        batch = np.ndarray(in_shape, dtype=np.uint8, buffer=tiles_shm.buf)
+        for k, tile in enumerate(tiles):
+            batch[k] = tile
+        del batch
+
+        fields = [(None, spec)] if isinstance(spec, tuple) else list(spec.items())
+        out_layout = []
+        for field, (shape, dtype) in fields:
+            nbytes = n * int(np.prod(shape)) * np.dtype(dtype).itemsize
+            out_layout.append((field, self._block(field or 'output', nbytes).name, tuple(shape), np.dtype(dtype).str))
+        return tiles_shm.name, in_shape, out_layout
+
+    def read(self, n, out_layout):
+        """
+        Per-tile copies of the outputs of the last batch (n tiles), in the backend's `run_tiles` format (copies: the
+        blocks are overwritten by the next batch, and each tile's output may be cached on its own)
+        """
+        arrays = {field: np.ndarray((n,) + shape, dtype=dtype, buffer=self._blocks[field or 'output'].buf)
+                  for field, _, shape, dtype in out_layout}
+        if None in arrays:
+            outputs = [a.copy() for a in arrays[None]]
+        else:
+            outputs = [{field: arrays[field][k].copy() for field in arrays} for k in range(n)]
+        del arrays
+        return outputs
+
+    def close(self):
+        for shm in self._blocks.values():
+            shm.close()
+            shm.unlink()
+        self._blocks = {}
+
+
+def _worker_main(conn, model_info, threads):
+    """Worker process: loads its own copy of the model, then runs tile ranges out of shared memory on request"""
+    try:
+        res = load_model(model_info)
+        if 'torch' in sys.modules:
+            sys.modules['torch'].set_num_threads(threads)
+        backend = importlib.import_module(res['process_region_func'].__module__)
+        kwargs = {'model': res['model'], 'metadata': model_info, 'additional_configs': model_info['additional_configs'],
+                  'input_buffer': TileBatchBuffer()}
+    except Exception:
+        conn.send(('error', traceback.format_exc()))
+        return
+    conn.send(('ready', None))
+
+    blocks = {}  # Shared memory name -> SharedMemory (kept open between batches)
+    while True:
+        message = conn.recv()
+        if message[0] == 'stop':
+            break
+
+        _, in_name, in_shape, out_layout, start, end = message
+        try:
+            for name in [in_name] + [layout[1] for layout in out_layout]:
+                if name not in blocks:
+                    blocks[name] = _attach(name)
+
+            tiles, outs = batch_views(blocks, in_name, in_shape, out_layout)
+            outputs = backend.run_tiles(list(tiles[start:end]), **kwargs)
+            store_outputs(outs, start, outputs)
+            del tiles, outs, outputs  # No views may be left on a block when it is closed
+
+            # Drop blocks the parent has replaced with bigger ones
+            for name in list(blocks):
+                if name != in_name and name not in [layout[1] for layout in out_layout]:
+                    blocks.pop(name).close()
+            conn.send(('done', None))
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+
+    for shm in blocks.values():
+        shm.close()
+
+
+class InferencePool:
+    """
+    Runs the tile batches of one model across `n_workers` processes, each with its own loaded copy of the model,
+    so CPU-only machines can use all their cores (one session/model alone keeps only a few busy).
+
+    A batch is split into contiguous shards, one per worker. Tiles go to the workers and results come back
+    through shared memory blocks (reused between batches, grown when needed) instead of being pickled, and
+    results are returned in tile order, in the same format as the backend's `run_tiles`.
+    Each worker gets cpu_count / n_workers threads. Batches smaller than `min_batch` are better run in-process
+    (see the backends' `infer`).
+    """
+
+    def __init__(self, model_info, n_workers, backend, min_batch=4):
+        self.model_info = model_info
+        self.n_workers = n_workers
+        self.backend = backend
+        self.min_batch = min_batch
+
+        threads = max(1, (os.cpu_count() or 1) // n_workers)
+        worker_info = dict(model_info, inference_workers=0)
+        worker_info['onnx_runtime'] = dict(model_info.get('onnx_runtime') or {}, intra_op_num_threads=threads,
+                                           inter_op_num_threads=1)
+
+        ctx = mp.get_context('spawn')  # Forking a process with ONNX Runtime/torch threads running is not safe
+        self._workers = []
+        for _ in range(n_workers):
+            conn, child_conn = ctx.Pipe()
+            process = ctx.Process(target=_worker_main, args=(child_conn, worker_info, threads), daemon=True)
+            process.start()
+            self._workers.append((process, conn))
+
+        self._batch = SharedBatch()
+        try:
+            for _, conn in self._workers:
+                self._receive(conn)
+        except Exception:
+            self.close()
+            raise
+
+    def _receive(self, conn):
+        try:
+            status, error = conn.recv()
+        except EOFError:
+            raise RuntimeError('Inference worker process died')
+        if status == 'error':
+            raise RuntimeError('Inference worker failed:\n' + error)
+
+    def run(self, tiles):
+        """Per-tile outputs of a list of (h, w, 3) uint8 tiles, computed by the workers"""
+        n = len(tiles)
+        spec = self.backend.tile_output_spec(tiles[0].shape, metadata=self.model_info)
+        in_name, in_shape, out_layout = self._batch.write(tiles, spec)
+
+        shards = [s for s in np.array_split(np.arange(n), min(self.n_workers, -(-n // self.min_batch))) if len(s)]
+        busy = self._workers[:len(shards)]
+        for (_, conn), shard in zip(busy, shards):
+            conn.send(('run', in_name, in_shape, out_layout, int(shard[0]), int(shard[-1]) + 1))
+        # Every busy worker's reply is read before raising, so none is left behind to answer the next call
+        errors = []
+        for _, conn in busy:
+            try:
+                self._receive(conn)
+            except RuntimeError as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+        return self._batch.read(n, out_layout)
+
+    def close(self):
+        for process, conn in self._workers:
+            try:
+                conn.send(('stop',))
+            except (BrokenPipeError, OSError):
+                pass
+        for process, _ in self._workers:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._workers = []
+
+        self._batch.close()
@@ -0,0 +1,369 @@
+"""
+Local inference server: one process owns the loaded models and runs the tile batches of any number of GUI windows
+on this machine (app.py started with REALTIME_GUI_SERVER=<host:port>), instead of every window loading its own copy
+of the model and running it next to its GUI thread.
+
+Clients connect over a local socket (multiprocessing.connection), authenticated with a random key that the server
+writes to the user's cache folder on its first start, readable by that user only (see server_key). Clients only name
+a metadata file of the server's own metadata folder (and a precision): the server never loads a path a client sends.
+Tile batches travel like they do to InferencePool's workers: the tiles and the per-tile results go through shared
+memory blocks owned by the client, only the block names go over the socket. Batches for the same model from different clients that arrive within --batch-window-ms of each
+other go through the model together. Tile caching and the blank filter still run in each client.
+
+    python inference_server.py                                  # listens on localhost:50763
+    REALTIME_GUI_SERVER=localhost:50763 python app.py           # as many windows as needed
+"""
+import argparse
+import importlib
+import json
+import os
+import queue
+import secrets
+import sys
+import threading
+import time
+import traceback
+from multiprocessing import AuthenticationError, shared_memory
+from multiprocessing.connection import Client, Listener
+
+from inference_pool import SharedBatch, batch_views, store_outputs
+from model_registry import ModelRegistry
+from quantize import PRECISIONS
+from utils import cache_path, micro_batch_size, resource_path, TileBatchBuffer
+
+
+DEFAULT_ADDRESS = 'localhost:50763'
+
+# Metadata "model" -> process_region backend module
+BACKENDS = {'ONNX': 'process_region_onnx', 'YOLO': 'process_region_YOLO'}
+
+
+def parse_address(address):
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+def server_key(create=False):
+    """
+    Connection key of the server and its clients: REALTIME_GUI_SERVER_KEY if set, otherwise a random key kept in the
+    user's cache folder, only readable by that user (created by the server, with create=True)
+    """
+    if os.environ.get('REALTIME_GUI_SERVER_KEY'):
+        return os.environ['REALTIME_GUI_SERVER_KEY'].encode()
+
+    path = cache_path('inference_server.key')
+    if create:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_hex(32))
+        except FileExistsError:
+            pass
+        if os.name == 'posix' and os.stat(path).st_mode & 0o077:
+            raise RuntimeError(f"{path} can be read by other users, delete it and start the server again")
+
+    try:
+        with open(path) as f:
+            return f.read().strip().encode()
+    except FileNotFoundError:
+        raise RuntimeError(f"No inference server key at {path}: start inference_server.py first (as this user), "
+                           f"or set REALTIME_GUI_SERVER_KEY")
+
+
+def read_metadata(metadata_dir, info_file, precision):
+    """The metadata of a model the server can load: a file of its own metadata folder, with the requested precision"""
+    if os.path.basename(info_file) != info_file or not info_file.endswith('.json'):
+        raise ValueError(f"Not a metadata file name: {info_file!r}")
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision!r}")
+    with open(os.path.join(metadata_dir, info_file)) as f:
+        return dict(json.load(f), precision=precision)
+
+
+def model_key(metadata):
+    # Clients asking for the same metadata (precision included) share one loaded model
+    return json.dumps(metadata, sort_keys=True)
+
+
+def _attach(name):
+    """Opens a shared memory block owned (and unlinked in the end) by a client process"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        from multiprocessing import resource_tracker
+
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')  # Otherwise unlinked when the server exits
+        return shm
+
+
+class ModelBatcher(threading.Thread):
+    """
+    Runs the tile batches of one model, for every client using it. While more than one client is connected,
+    batches arriving within `window` seconds of each other (with the same tile shape) are merged, up to the
+    model's micro-batch size (see utils.micro_batch_size).
+    """
+
+    def __init__(self, metadata, registry, window=0.005):
+        super().__init__(daemon=True)
+        self.metadata = metadata
+        self.registry = registry
+        self.window = window
+        self.clients = 0  # Connected clients using this model (see attach/detach)
+        self.batches = 0
+        self.tiles = 0
+
+        self._requests = queue.Queue()
+        self._held = None  # Request that did not fit in the last batch
+        self._input_buffer = TileBatchBuffer()
+        self._lock = threading.Lock()
+
+    def attach(self):
+        with self._lock:
+            self.clients += 1
+            return self.clients
+
+    def detach(self):
+        with self._lock:
+            self.clients -= 1
+
+    def submit(self, tiles):
+        """Per-tile outputs of `tiles` (blocks until they have been run)"""
+        request = {'tiles': tiles, 'done': threading.Event(), 'outputs': None, 'error': None}
+        self._requests.put(request)
+        request['done'].wait()
+        if request['error'] is not None:
+            raise RuntimeError(request['error'])
+        return request['outputs']
+
+    def stop(self):
+        self._requests.put(None)
+
+    def _next_batch(self):
+        first, self._held = self._held or self._requests.get(), None
+        if first is None:
+            return None
+
+        batch = [first]
+        shape = first['tiles'][0].shape
+        n, max_tiles = len(first['tiles']), micro_batch_size(self.metadata, shape)
+        deadline = time.perf_counter() + self.window
+        while self.clients > 1 and n < max_tiles:
+            try:
+                request = self._requests.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                break
+            if request is None or request['tiles'][0].shape != shape or n + len(request['tiles']) > max_tiles:
+                self._held = request
+                break
+            batch.append(request)
+            n += len(request['tiles'])
+        return batch
+
+    def run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            tiles = [tile for request in batch for tile in request['tiles']]
+            try:
+                res = self.registry.get(model_key(self.metadata), self.metadata)  # Reloaded if it was evicted
+                backend = importlib.import_module(res['process_region_func'].__module__)
+                pool = res.get('pool')
+                if pool is not None and len(tiles) >= pool.min_batch:
+                    outputs = pool.run(tiles)
+                else:
+                    outputs = backend.run_tiles(tiles, model=res['model'], metadata=self.metadata,
+                                                additional_configs=self.metadata['additional_configs'],
+                                                input_buffer=self._input_buffer)
+                start = 0
+                for request in batch:
+                    request['outputs'] = outputs[start:start + len(request['tiles'])]
+                    start += len(request['tiles'])
+            except Exception:
+                error = traceback.format_exc()
+                for request in batch:
+                    request['error'] = error
+
+            self.batches += 1
+            self.tiles += len(tiles)
+            for request in batch:
+                request['done'].set()
+
+
+class InferenceServer:
+    """
+    Accepts clients on `address` ('host:port', port 0 = any free port) and serves them until `close`, with the models
+    described in `metadata_dir`
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, max_bytes=4 * 1024 ** 3, batch_window=0.005, metadata_dir=None):
+        self.registry = ModelRegistry(max_bytes=max_bytes)
+        self.batch_window = batch_window
+        self.metadata_dir = metadata_dir or resource_path('metadata')
+
+        self._batchers = {}  # model_key -> ModelBatcher
+        self._lock = threading.Lock()
+        self._listener = Listener(parse_address(address), authkey=server_key(create=True))
+        self.address = '{}:{}'.format(*self._listener.address)
+
+    def _batcher(self, metadata):
+        with self._lock:
+            key = model_key(metadata)
+            if key not in self._batchers:
+                self._batchers[key] = ModelBatcher(metadata, self.registry, self.batch_window)
+                self._batchers[key].start()
+            return self._batchers[key]
+
+    def serve_forever(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+            except AuthenticationError:
+                continue
+            except OSError:
+                return  # Closed
+            threading.Thread(target=self._serve_client, args=(conn,), daemon=True).start()
+
+    def _serve_client(self, conn):
+        blocks = {}  # Shared memory name -> SharedMemory of this client (kept open between batches)
+        batcher = info_file = None
+        try:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    break
+
+                try:
+                    if message[0] == 'load':
+                        _, info_file, precision = message
+                        metadata = read_metadata(self.metadata_dir, info_file, precision)
+                        res = self.registry.get(model_key(metadata), metadata)  # Load errors are reported here
+                        if batcher is not None:
+                            batcher.detach()
+                        batcher = self._batcher(metadata)
+                        clients = batcher.attach()
+                        print(f"Client connected: {info_file} ({precision}, {clients} client(s) on this model)")
+                        conn.send(('ready', {'using_gpu': res['using_gpu']}))
+
+                    elif message[0] == 'run':
+                        _, in_name, in_shape, out_layout = message
+                        names = [in_name] + [layout[1] for layout in out_layout]
+                        for name in list(blocks):
+                            if name not in names:
+                                blocks.pop(name).close()  # Replaced by a bigger block on the client side
+                        for name in names:
+                            if name not in blocks:
+                                blocks[name] = _attach(name)
+
+                        tiles, outs = batch_views(blocks, in_name, in_shape, out_layout)
+                        store_outputs(outs, 0, batcher.submit(list(tiles)))
+                        del tiles, outs  # No views may be left on a block when it is closed
+                        conn.send(('done', None))
+                except Exception:
+                    conn.send(('error', traceback.format_exc()))
+        finally:
+            if batcher is not None:
+                batcher.detach()
+                print(f"Client disconnected: {info_file} ({batcher.batches} batches so far, "
+                      f"{batcher.tiles / max(batcher.batches, 1):.1f} tiles per batch)")
+            for shm in blocks.values():
+                shm.close()
+            conn.close()
+
+    def close(self):
+        self._listener.close()
+        for batcher in self._batchers.values():
+            batcher.stop()
+        self.registry.clear()
+
+
+class InferenceClient:
+    """
+    Connection to an InferenceServer for one model, with the same `run`/`min_batch`/`n_workers`/`close` interface as
+    InferencePool: the backends' `infer` sends its tile batches (the cache misses) to the server through it.
+    The server loads the model from its own copy of model_info['info_file'] (see app.get_model_info).
+    """
+
+    min_batch = 1
+    n_workers = 1
+
+    def __init__(self, address, model_info, backend):
+        self.model_info = model_info
+        self.backend = backend
+
+        self._conn = Client(parse_address(address), authkey=server_key())
+        self._batch = SharedBatch()
+        self._lock = threading.Lock()
+
+        self._conn.send(('load', model_info['info_file'], model_info.get('precision', 'fp32')))
+        self.using_gpu = self._receive()['using_gpu']
+
+    def _receive(self):
+        try:
+            status, payload = self._conn.recv()
+        except EOFError:
+            raise RuntimeError('Inference server closed the connection')
+        if status == 'error':
+            raise RuntimeError('Inference server failed:\n' + payload)
+        return payload
+
+    def run(self, tiles):
+        """Per-tile outputs of a list of (h, w, 3) uint8 tiles, computed by the server"""
+        with self._lock:
+            spec = self.backend.tile_output_spec(tiles[0].shape, metadata=self.model_info)
+            in_name, in_shape, out_layout = self._batch.write(tiles, spec)
+            self._conn.send(('run', in_name, in_shape, out_layout))
+            self._receive()
+            return self._batch.read(len(tiles), out_layout)
+
+    def close(self):
+        self._conn.close()
+        self._batch.close()
+
+
+def connect_model(model_info, progress=None, address=DEFAULT_ADDRESS):
+    """
+    Stand-in for `utils.load_model` in thin-client mode: same result dict, but the model lives in the server and
+    'pool' is the InferenceClient that reaches it ('model' is None).
+    """
+    if progress is not None:
+        progress('Loading (server)')
+    backend = importlib.import_module(BACKENDS[model_info['model']])
+    client = InferenceClient(address, model_info, backend)
+    return {
+        'model': None,
+        'process_region_func': backend.process_region,
+        'pipeline_funcs': (backend.prepare, backend.infer, backend.render),
+        'using_gpu': client.using_gpu,
+        'model_path': None,
+        'pool': client,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--address', default=DEFAULT_ADDRESS, help='host:port to listen on')
+    parser.add_argument('--max-gb', type=float, default=4, help='memory budget of the loaded models (see model_registry.py)')
+    parser.add_argument('--metadata-dir', help='folder of the model metadata files clients can ask for (default: metadata/)')
+    parser.add_argument('--batch-window-ms', type=float, default=5,
+                        help='how long a batch waits for other clients\' batches of the same model')
+    args = parser.parse_args()
+
+    server = InferenceServer(args.address, max_bytes=int(args.max_gb * 1024 ** 3),
+                             batch_window=args.batch_window_ms / 1000, metadata_dir=args.metadata_dir)
+    print(f"Inference server listening on {server.address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    import multiprocessing
+    multiprocessing.freeze_support()  # Inference worker processes of the loaded models (inference_pool.py)
+    sys.exit(main())
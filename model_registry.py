@@ -0,0 +1,130 @@
+import gc
+import os
+import threading
+from collections import OrderedDict
+
+from utils import load_model
+
+
+def model_nbytes(res):
+    """Rough memory footprint of a loaded model: the size of its weights on disk (once per copy, see inference_pool.py)"""
+    path = res.get('model_path')
+    copies = 1 + (res['pool'].n_workers if res.get('pool') is not None else 0)
+    if path and os.path.exists(path):
+        if os.path.isdir(path):
+            return copies * sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+        return copies * os.path.getsize(path)
+    return 0
+
+
+def release_model(res):
+    """Stops what a loaded model runs outside of Python's garbage collection (worker processes)"""
+    if res.get('pool') is not None:
+        res['pool'].close()
+
+
+class ModelRegistry:
+    """
+    Keeps loaded models (the dicts returned by `utils.load_model`) in memory so switching models or pressing
+    Start again reuses the warm engine instead of reloading it.
+
+    Least recently used models are evicted once the total size of the loaded models goes over `max_bytes`
+    (the most recently used model is always kept, even if it alone is over the budget). Pinned models (the ones
+    running, see `pin`) are never evicted.
+    Safe to use from several threads; loads are serialized so the same model is never loaded twice at once.
+    """
+
+    def __init__(self, max_bytes=2 * 1024 ** 3, loader=load_model):
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self.evictions = 0
+
+        self._models = OrderedDict()  # key -> (res, nbytes)
+        self._pins = {}  # key -> number of users holding the model (see pin)
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._models
+
+    def loaded(self):
+        with self._lock:
+            return list(self._models)
+
+    @property
+    def nbytes(self):
+        with self._lock:
+            return sum(nbytes for _, nbytes in self._models.values())
+
+    def get(self, key, model_info, progress=None, pin=False):
+        """
+        Returns the loaded model for `key`, loading it with `model_info` (metadata) if needed.
+        progress: optional callback passed to the loader (see utils.load_model)
+        pin: also pin the model (see `pin`), atomically so it cannot be evicted in between
+        """
+        with self._lock:
+            if key in self._models:
+                return self._use(key, pin)
+
+        with self._load_lock:
+            with self._lock:  # Someone else may have loaded it while we waited
+                if key in self._models:
+                    return self._use(key, pin)
+
+            res = self.loader(model_info, progress=progress)
+
+            with self._lock:
+                self._models[key] = (res, model_nbytes(res))
+                res = self._use(key, pin)
+                self._evict()
+            return res
+
+    def _use(self, key, pin):
+        # Called with the lock held
+        self._models.move_to_end(key)
+        if pin:
+            self._pins[key] = self._pins.get(key, 0) + 1
+        return self._models[key][0]
+
+    def pin(self, key):
+        """Keeps a loaded model from being evicted (e.g. while a pipeline runs it) until `unpin` is called as often"""
+        with self._lock:
+            self._pins[key] = self._pins.get(key, 0) + 1
+
+    def unpin(self, key):
+        with self._lock:
+            if self._pins.get(key, 0) <= 1:
+                self._pins.pop(key, None)
+            else:
+                self._pins[key] -= 1
+            self._evict()  # Evictions held back by the pin
+
+    def _evict(self):
+        # Least recently used first, never the most recently used one nor pinned ones
+        for key in list(self._models)[:-1]:
+            if self.nbytes <= self.max_bytes:
+                break
+            if key in self._pins:
+                continue
+            res, _ = self._models.pop(key)
+            release_model(res)
+            self.evictions += 1
+            print(f"Model registry: evicted {key}")
+        gc.collect()
+
+    def unload(self, key):
+        with self._lock:
+            removed = self._models.pop(key, None)
+        if removed is not None:
+            release_model(removed[0])
+            gc.collect()
+        return removed is not None
+
+    def clear(self):
+        with self._lock:
+            models = list(self._models.values())
+            self._models.clear()
+        for res, _ in models:
+            release_model(res)
+        gc.collect()
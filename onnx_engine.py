@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import onnxruntime as ort
+
+from utils import cache_path
+
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+EXECUTION_MODES = {
+    'sequential': ort.ExecutionMode.ORT_SEQUENTIAL,
+    'parallel': ort.ExecutionMode.ORT_PARALLEL,
+}
+
+# Used for anything not set in the model's metadata "onnx_runtime" block
+DEFAULT_SETTINGS = {
+    'graph_optimization_level': 'all',
+    'intra_op_num_threads': 0,  # 0 = let ONNX Runtime decide (number of physical cores)
+    'inter_op_num_threads': 0,
+    'execution_mode': 'sequential',
+    'enable_cpu_mem_arena': True,
+    'cache_optimized_model': True,  # Save the optimized graph to disk so later launches skip optimization
+    'warmup': True,
+}
+
+
+class OnnxEngine:
+    """
+    Wraps an ort.InferenceSession configured from a model's metadata:
+    - session options (graph optimization level, intra/inter-op threads, execution mode, memory arena)
+    - the optimized graph is serialized to the cache folder on first load and loaded as-is afterwards
+    - inference goes through IO binding with a preallocated output buffer
+    - one warm-up pass at load time so the first real frame doesn't pay for allocations
+
+    `get_inputs`/`get_outputs`/`run` are passed through to the session so it can still be used like one.
+    """
+
+    def __init__(self, model_path, providers, settings=None, warmup_shape=None):
+        self.model_path = model_path
+        self.providers = providers
+        self.settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+
+        self.session = self._create_session()
+
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_name = self.session.get_outputs()[0].name
+        self.output_dims = self.session.get_outputs()[0].shape[1:]  # Non-batch output dims
+
+        self._binding = self.session.io_binding()
+        self._output_buffer = None
+
+        if self.settings['warmup']:
+            self.warmup(warmup_shape)
+
+    def _optimized_model_path(self):
+        # Optimized graphs are specific to the ORT version, the execution provider and the optimization level
+        stat = os.stat(self.model_path)
+        key = json.dumps([os.path.abspath(self.model_path), stat.st_size, stat.st_mtime, ort.__version__,
+                          self.providers, self.settings['graph_optimization_level']])
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        return cache_path('onnx_optimized', '{}_{}.onnx'.format(os.path.splitext(os.path.basename(self.model_path))[0], digest))
+
+    def _session_options(self):
+        s = self.settings
+        so = ort.SessionOptions()
+        so.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[s['graph_optimization_level']]
+        so.intra_op_num_threads = s['intra_op_num_threads']
+        so.inter_op_num_threads = s['inter_op_num_threads']
+        so.execution_mode = EXECUTION_MODES[s['execution_mode']]
+        so.enable_cpu_mem_arena = s['enable_cpu_mem_arena']
+        return so
+
+    def _create_session(self):
+        so = self._session_options()
+
+        if not self.settings['cache_optimized_model'] or self.settings['graph_optimization_level'] == 'disable':
+            return ort.InferenceSession(self.model_path, sess_options=so, providers=self.providers)
+
+        optimized_path = self._optimized_model_path()
+        if os.path.exists(optimized_path):
+            # Already optimized, so skip graph optimization entirely
+            so.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS['disable']
+            try:
+                return ort.InferenceSession(optimized_path, sess_options=so, providers=self.providers)
+            except Exception as e:
+                print(f"Could not load cached optimized model {optimized_path} ({e}), re-optimizing")
+                so = self._session_options()
+
+        so.optimized_model_filepath = optimized_path
+        return ort.InferenceSession(self.model_path, sess_options=so, providers=self.providers)
+
+    def warmup(self, shape=None):
+        """Runs one batch of zeros through the model. Symbolic input dims are taken from `shape` (or set to 1)"""
+        input_shape = self.session.get_inputs()[0].shape
+        shape = [
+            dim if isinstance(dim, int) else (shape[i] if shape is not None else 1)
+            for i, dim in enumerate(input_shape)
+        ]
+        shape[0] = 1
+        self.run_batch(np.zeros(shape, dtype=np.float32))
+
+    def _bound_output(self, n):
+        if not all(isinstance(d, int) for d in self.output_dims):
+            return None  # Output shape not known ahead of time, let ORT allocate it
+
+        if self._output_buffer is None or self._output_buffer.shape[0] < n:
+            self._output_buffer = np.empty([n] + self.output_dims, dtype=np.float32)
+        return self._output_buffer[:n]
+
+    def run_batch(self, batch):
+        """
+        Runs a contiguous float32 batch and returns the first output. The returned array may be a view into the
+        engine's output buffer, valid until the next call (copy whatever needs to be kept).
+        """
+        self._binding.clear_binding_outputs()
+        self._binding.bind_cpu_input(self.input_name, batch)
+
+        out = self._bound_output(batch.shape[0])
+        if out is not None:
+            self._binding.bind_output(self.output_name, 'cpu', 0, np.float32, list(out.shape), out.ctypes.data)
+        else:
+            self._binding.bind_output(self.output_name, 'cpu')
+
+        self.session.run_with_iobinding(self._binding)
+
+        if out is None:
+            out = self._binding.copy_outputs_to_cpu()[0]
+        return out
+
+    def run_batch_all(self, batch):
+        """Like `run_batch`, but returns every output of the model (allocated by ONNX Runtime, so safe to keep)"""
+        self._binding.clear_binding_outputs()
+        self._binding.bind_cpu_input(self.input_name, batch)
+        for output in self.session.get_outputs():
+            self._binding.bind_output(output.name, 'cpu')
+
+        self.session.run_with_iobinding(self._binding)
+        return self._binding.copy_outputs_to_cpu()
+
+    def get_inputs(self):
+        return self.session.get_inputs()
+
+    def get_outputs(self):
+        return self.session.get_outputs()
+
+    def run(self, output_names, input_feed):
+        return self.session.run(output_names, input_feed)
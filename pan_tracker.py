@@ -0,0 +1,127 @@
+import numpy as np
+
+
+class PanTracker:
+    """
+    Follows the panning of the slide viewer so the tile grid moves with the slide instead of staying put on screen.
+
+    Each frame sent to the model is compared to the previous one by phase correlation, first on a grayscale copy
+    subsampled to roughly `sample_size` px, then refined at full resolution on a central `patch_size` patch.
+    When the frame is the previous one translated by a whole number of pixels, the grid origin (top-left corner of
+    the first tile) is moved by the same amount. Tiles that were already on screen then have exactly the same pixels
+    as before, so their results (and overlays, which move with them) come out of the tile cache, and only the tiles
+    over the newly exposed strips go through the model.
+
+    Like the remainder at the right/bottom with origin 0, the strips before the origin and after the last whole tile
+    are not inferred, so the grid can be a row/column short of the origin 0 one while panning. On an axis where no
+    tile would fit at all, the grid snaps back to 0. Anything that is not a clean pan (zoom, new slide, ...) leaves
+    the origin where it is. Each tile size has its own grid (models with different tile sizes can run on one capture).
+    """
+
+    def __init__(self, sample_size=256, patch_size=256, min_response=0.1, max_error=2.0):
+        self.sample_size = sample_size
+        self.patch_size = patch_size
+        self.min_response = min_response  # Phase correlation peak below this = not a translation
+        self.max_error = max_error  # Mean absolute pixel difference (0-255) allowed after aligning the patches
+
+        self.origins = {}  # Tile size -> (y, x) grid origin, (0, 0) until the first pan
+        self.last_shift = None  # (dy, dx) of the content between the last two frames, None if not a pan
+        self.frames_seen = 0
+        self.frames_panned = 0
+
+        self._reference = None  # (frame shape, subsampled gray frame, full-res gray patch) of the previous frame
+        self._windows = {}
+
+    def reset(self):
+        """Back to origin 0, and the next frame is not compared to anything (e.g. after the region or configs change)"""
+        self.origins = {}
+        self._reference = None
+
+    def _window(self, shape):
+        import cv2
+
+        if shape not in self._windows:
+            self._windows[shape] = cv2.createHanningWindow(shape[::-1], cv2.CV_32F)
+        return self._windows[shape]
+
+    def _correlate(self, reference, image):
+        # ((dx, dy), peak) of `image` relative to `reference`. phaseCorrelate applies the window to its inputs in place
+        # (OpenCV 5), so it gets copies: the references are kept for the next frame
+        import cv2
+
+        return cv2.phaseCorrelate(reference.copy(), image.copy(), self._window(reference.shape))
+
+    @staticmethod
+    def _gray(image):
+        import cv2
+
+        return cv2.cvtColor(np.ascontiguousarray(image[..., :3]), cv2.COLOR_BGR2GRAY).astype(np.float32)
+
+    def _patch_box(self, shape, dy=0, dx=0):
+        # (y0, y1, x0, x1) of the central patch moved by (dy, dx), or None if that falls off the frame
+        size = min(self.patch_size, shape[0], shape[1])
+        y0, x0 = (shape[0] - size) // 2 + dy, (shape[1] - size) // 2 + dx
+        if y0 < 0 or x0 < 0 or y0 + size > shape[0] or x0 + size > shape[1]:
+            return None
+        return y0, y0 + size, x0, x0 + size
+
+    def estimate_shift(self, frame):
+        """(dy, dx) the content moved by since the previous frame, or None if it is not a pure translation"""
+        step = max(1, max(frame.shape[:2]) // self.sample_size)
+        small = self._gray(frame[::step, ::step])
+        y0, y1, x0, x1 = self._patch_box(frame.shape)
+        patch = self._gray(frame[y0:y1, x0:x1])
+
+        reference, self._reference = self._reference, (frame.shape, small, patch)
+        if reference is None or reference[0] != frame.shape:
+            return None
+        _, ref_small, ref_patch = reference
+
+        # Coarse shift on the subsampled frames, then the residual on full-resolution patches
+        (dx, dy), response = self._correlate(ref_small, small)
+        if response < self.min_response:
+            return None
+        dy, dx = int(round(dy * step)), int(round(dx * step))
+
+        box = self._patch_box(frame.shape, dy, dx)
+        if box is None:
+            return None
+        (rx, ry), _ = self._correlate(ref_patch, self._gray(frame[box[0]:box[1], box[2]:box[3]]))
+        dy, dx = dy + int(round(ry)), dx + int(round(rx))
+
+        # Only a whole-pixel match is useful (tiles have to come out identical to hit the cache)
+        box = self._patch_box(frame.shape, dy, dx)
+        if box is None:
+            return None
+        error = np.mean(np.abs(self._gray(frame[box[0]:box[1], box[2]:box[3]]) - ref_patch))
+        return (dy, dx) if error <= self.max_error else None
+
+    def update(self, frame, tile_sizes):
+        """
+        Tracks the pan from the previous frame to this one and returns the (y, x) grid origin to tile it with,
+        for each of `tile_sizes` ({tile size: origin})
+        """
+        self.frames_seen += 1
+        self.last_shift = self.estimate_shift(frame)
+        if self.last_shift is not None and self.last_shift != (0, 0):
+            self.frames_panned += 1
+
+        for tile_size in tile_sizes:
+            origin = self.origins.get(tile_size, (0, 0))
+            if self.last_shift is not None:
+                moved = []
+                for size, start, shift in zip(frame.shape[:2], origin, self.last_shift):
+                    start = (start + shift) % tile_size
+                    if size - start < tile_size:
+                        start = 0  # No whole tile would fit after the origin
+                    moved.append(start)
+                origin = tuple(moved)
+            self.origins[tile_size] = origin
+        return {tile_size: self.origins[tile_size] for tile_size in tile_sizes}
+
+    def summary(self):
+        if len(self.origins) <= 1:
+            grids = 'grid at {}'.format(next(iter(self.origins.values()), (0, 0)))
+        else:
+            grids = 'grids at ' + ', '.join('{} ({} px)'.format(o, size) for size, o in sorted(self.origins.items()))
+        return 'followed {} pans, {}'.format(self.frames_panned, grids)
@@ -0,0 +1,138 @@
+import threading
+import traceback
+from collections import deque
+
+
+class DropOldestQueue:
+    """
+    Bounded hand-off queue between pipeline stages. When full, `put` drops the oldest item instead of blocking, so a
+    slow downstream stage always picks up the freshest frame rather than working through a backlog.
+    With block=True, `put` waits for room instead (every item gets through, e.g. when replaying a recording).
+    `on_drop` is called for every item that is dropped (or left over when the queue is closed).
+    """
+
+    def __init__(self, maxsize=1, on_drop=None, block=False):
+        self.maxsize = maxsize
+        self.on_drop = on_drop
+        self.block = block
+        self.dropped = 0
+        self.draining = False  # Closed with drain=True
+
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def put(self, item):
+        dropped = []
+        with self._cond:
+            if self.block:
+                self._cond.wait_for(lambda: len(self._items) < self.maxsize or self._closed)
+            if self._closed:
+                dropped.append(item)
+            else:
+                while len(self._items) >= self.maxsize:
+                    dropped.append(self._items.popleft())
+                    self.dropped += 1
+                self._items.append(item)
+                self._cond.notify_all()
+
+        for d in dropped:
+            self._drop(d)
+
+    def get(self, timeout=None):
+        """Returns the next item, or None once the queue is closed (and drained) or on timeout"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._items or self._closed, timeout=timeout)
+            if self._items:
+                item = self._items.popleft()
+                self._cond.notify_all()  # Room for a blocked put
+                return item
+            return None
+
+    def close(self, drain=False):
+        """No more puts. drain=True: the items still queued are handed out first, otherwise they are dropped."""
+        with self._cond:
+            self._closed = True
+            self.draining = drain
+            leftover = [] if drain else list(self._items)
+            if not drain:
+                self._items.clear()
+            self._cond.notify_all()
+
+        for d in leftover:
+            self._drop(d)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def _drop(self, item):
+        if self.on_drop is not None:
+            self.on_drop(item)
+
+
+class StageWorker(threading.Thread):
+    """
+    Runs `fn` on every item from `in_queue` and puts the result on `out_queue` (if there is one and the result is
+    not None). Stops when `in_queue` is closed (after its last items if it was drained, and then drains `out_queue`
+    too). An exception in `fn` is stored on `error`, the failed item is passed to `on_error` and the stage shuts its
+    queues down so the rest of the pipeline stops as well.
+    """
+
+    def __init__(self, name, fn, in_queue, out_queue=None, on_error=None):
+        super().__init__(name=name, daemon=True)
+        self.fn = fn
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.on_error = on_error
+        self.error = None
+
+    def run(self):
+        while True:
+            item = self.in_queue.get()
+            if item is None:
+                break
+
+            try:
+                out = self.fn(item)
+            except Exception as e:
+                traceback.print_exc()
+                self.error = e
+                if self.on_error is not None:
+                    self.on_error(item)
+                self.in_queue.close()
+                break
+
+            if out is not None and self.out_queue is not None:
+                self.out_queue.put(out)
+
+        if self.out_queue is not None:
+            self.out_queue.close(drain=self.in_queue.draining and self.error is None)
+
+
+class Mailbox:
+    """
+    Single-slot, non-blocking hand-off of the latest item (e.g. worker -> GUI thread). `post` replaces whatever is
+    still waiting, so a slow consumer only ever sees the newest item and nothing piles up.
+    `post` returns True when the box was empty, i.e. when the consumer needs to be notified: one notification is
+    pending at most, however fast items come in.
+    """
+
+    def __init__(self):
+        self.dropped = 0
+        self._item = None
+        self._lock = threading.Lock()
+
+    def post(self, item):
+        with self._lock:
+            was_empty = self._item is None
+            if not was_empty:
+                self.dropped += 1
+            self._item = item
+        return was_empty
+
+    def take(self):
+        """Returns the latest item (None if there is none) and empties the box"""
+        with self._lock:
+            item, self._item = self._item, None
+        return item
@@ -1,102 +1,224 @@
-import mss
 import numpy as np
-import cv2
 
-from utils import extract_tiles
+from utils import extract_tiles, tile_grid, crop_to_tiles, grab_region, micro_batch_size
+from tile_cache import run_cached, cache_namespace
+from tile_filter import blank_tiles, run_filtered, tissue_only, summary as blank_summary
 
-def process_region(region, **kwargs):
 
-    metadata = kwargs['metadata']
-    model = kwargs['model']
+# Mask colours (BGR) by class index, and how strongly they are blended onto the frame
+CLASS_COLORS = [
+    (0, 0, 255),  # positive. red
+    (255, 0, 0),  # negative. blue
+    (0, 255, 0),  # misc. green
+]
+MASK_ALPHA = 0.5
+
+
+def reduce_detections(cls, masks, n_per_tile, tile_shape, n_classes):
+    """
+    Turns the detections of a batch of tiles into one compact result per tile:
+    {'labels': (h, w) uint8 label map, 'counts': (n_classes,) detections per class}
 
-    ###
+    cls: (M,) class of every detection in the batch, masks: (M, h, w) 0/1 uint8, n_per_tile: detections per tile
+    (detections are ordered by tile). Label 0 is background, otherwise label = n_classes - class, so where masks
+    overlap the lower class index wins (positive over negative over misc). Done with one batched reduction.
+    """
+    n_tiles = len(n_per_tile)
+    labels = np.zeros((n_tiles,) + tuple(tile_shape), dtype=np.uint8)
+    counts = np.zeros((n_tiles, n_classes), dtype=np.int64)
 
-    tile_size = metadata['tile_size']
+    if len(cls):
+        cls = np.asarray(cls, dtype=np.int64)
+        n_per_tile = np.asarray(n_per_tile)
+        np.add.at(counts, (np.repeat(np.arange(n_tiles), n_per_tile), cls), 1)
 
-    with mss.mss() as sct:
-        screenshot = sct.grab(region)
+        tiles_with_dets = np.flatnonzero(n_per_tile)
+        starts = (np.cumsum(n_per_tile) - n_per_tile)[tiles_with_dets]
+        labels[tiles_with_dets] = np.maximum.reduceat(masks * (n_classes - cls).astype(np.uint8)[:, None, None],
+                                                      starts, axis=0)
 
-    frame = np.array(screenshot, dtype=np.uint8)
-    frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
-    frame = frame[:max((frame.shape[0]//tile_size)*tile_size, tile_size), :max((frame.shape[1]//tile_size)*tile_size, tile_size), :]
+    return [{'labels': labels[k].copy(), 'counts': counts[k]} for k in range(n_tiles)]
 
-    slices = extract_tiles(frame, tile_size)
 
-    # Detect and render
-    results = model(slices)
+def infer_tiles(model, slices, n_classes):
+    """Runs YOLO on a list of tiles and returns one {'labels', 'counts'} dict per tile (see reduce_detections)"""
+    if hasattr(model, 'predict_tiles'):
+        # Exported ONNX/OpenVINO model (yolo_engine.YoloExportedEngine), already in numpy
+        cls, masks, n_per_tile = model.predict_tiles(slices)
+        return reduce_detections(cls, masks, n_per_tile, slices[0].shape[:2], n_classes)
 
-    from ultralytics.utils.plotting import Annotator
-    from ultralytics.data.augment import LetterBox
     import torch
 
+    # retina_masks: masks come back at tile resolution (no letterbox to undo)
+    results = model([np.ascontiguousarray(s) for s in slices], retina_masks=True)
+
+    # One device -> host transfer for the whole batch instead of one per tile
+    n_per_tile = [len(r.boxes) for r in results]
+    if sum(n_per_tile) == 0:
+        return reduce_detections([], None, n_per_tile, slices[0].shape[:2], n_classes)
+
+    cls = torch.cat([r.boxes.cls for r in results]).to(torch.int64).cpu().numpy()
+    masks = torch.cat([r.masks.data for r in results if r.masks is not None]).to(torch.uint8).cpu().numpy()
+
+    return reduce_detections(cls, masks, n_per_tile, slices[0].shape[:2], n_classes)
+
+
+def run_tiles(slices, **kwargs):
+    """Per-tile outputs of a list of tiles, in this process (see inference_pool.py for the multi-process version)"""
+    return infer_tiles(kwargs['model'], slices, len(kwargs['metadata']['classes']))
+
+
+def tile_output_spec(tile_shape, **kwargs):
+    """{field: (shape, dtype)} of one tile's output, so worker processes can write it to shared memory"""
+    return {'labels': (tuple(tile_shape[:2]), np.uint8), 'counts': ((len(kwargs['metadata']['classes']),), np.int64)}
+
+
+def prepare(frame, **kwargs):
+    """
+    Pipeline stage 1: crop the grabbed frame and split it into tiles.
+    The tile grid starts at kwargs['grid_origin'] ((y, x), see pan_tracker.py) if given, the displayed frame does not move.
+    kwargs['shared_tiles'] (tile_cache.SharedTiles of that grid) is used instead when several models/regions share the frame.
+    """
+    tile_size = kwargs['metadata']['tile_size']
+    origin_y, origin_x = kwargs.get('grid_origin') or (0, 0)
 
+    grid_frame = frame[origin_y:, origin_x:]
+    shared = kwargs.get('shared_tiles')
+    slices = shared.slices if shared is not None else extract_tiles(grid_frame, tile_size)
+    frame = crop_to_tiles(frame, tile_size)
 
-    tile_size_y = tile_size_x = tile_size
-    if frame.shape[0] < tile_size:
-        tile_size_y = frame.shape[0]
-    if frame.shape[1] < tile_size:
-        tile_size_x = frame.shape[1]
-
-    seg_mask = np.zeros(frame.shape)
-    k = 0
-    for i in range(frame.shape[0] // tile_size_y):
-        for j in range(frame.shape[1] // tile_size_x):
-            # need to override so that i can choose mask colors...
-            if results[k].masks is not None and results[k].masks.shape[0] != 0:
-                annotator = Annotator(
-                    np.ascontiguousarray(results[k].orig_img),
-                    line_width=None,
-                    font_size=None,
-                    font="Arial.ttf",
-                    pil=False,
-                    example=results[0].names,
-                )
-                img = LetterBox(results[k].masks.shape[1:])(image=annotator.result())
-                im_gpu = (
-                        torch.as_tensor(img, dtype=torch.float16, device=results[k].masks.data.device)
-                        .permute(2, 0, 1)
-                        .flip(0)
-                        .contiguous()
-                        / 255
-                )
-                colors = {
-                    0: (0, 0, 255),  # positive. red
-                    1: (255, 0, 0),  # negative. blue
-                    2: (0, 255, 0),  # misc. green
-                }
-                annotator.masks(results[k].masks.data,
-                                colors=[colors[x] for x in results[k].boxes.cls.cpu().numpy()], im_gpu=im_gpu)
-
-                seg_mask[
-                (i * tile_size):((i * tile_size) + tile_size),
-                (j * tile_size):((j * tile_size) + tile_size),
-                :
-                # ] = results[k].plot(labels=False, boxes=False)
-                ] = annotator.result()
-
-            else:
-                # no masks found
-                seg_mask[
-                (i * tile_size):((i * tile_size) + tile_size),
-                (j * tile_size):((j * tile_size) + tile_size),
-                :
-                ] = frame[
-                    (i * tile_size):((i * tile_size) + tile_size),
-                    (j * tile_size):((j * tile_size) + tile_size),
-                    :
-                    ]
-
-            k += 1
-
-    num_pos = 0
-    num_pos_neg = 0
-    for r in results:
-        num_pos_curr = torch.sum(r.boxes.cls == 0).cpu().numpy()
-        num_pos += num_pos_curr
-        num_pos_neg += num_pos_curr + torch.sum(r.boxes.cls == 1).cpu().numpy()
+    return {'frame': frame, 'slices': slices, 'origin': (origin_y, origin_x),
+            'grid_shape': tile_grid(grid_frame, tile_size).shape[:4], 'shared_tiles': shared}
+
+
+def infer(state, **kwargs):
+    """
+    Pipeline stage 2: per-tile detections (only tiles missing from the cache go through the model).
+    Tiles go through the model in micro-batches (see utils.micro_batch_size), so the masks of only one batch are
+    in memory at a time, and cell counts are summed as they come in.
+    Tiles flagged by the model's "blank_filter" (see tile_filter.py) skip the model: no detections.
+    """
+    metadata = kwargs['metadata']
+    cache = kwargs.get('cache')  # Optional TileCache
+    pool = kwargs.get('pool')  # Optional InferencePool (worker processes)
+
+    run = lambda s: pool.run(s) if pool is not None and len(s) >= pool.min_batch else run_tiles(s, **kwargs)
+    namespace = cache_namespace(metadata, kwargs['additional_configs'])
+
+    slices = state['slices']
+    shared = state.get('shared_tiles')  # Tile digests shared with the other models on this frame
+    batch_size = micro_batch_size(metadata, slices[0].shape) * (pool.n_workers if pool is not None else 1)
+    empty = reduce_detections([], None, [0], slices[0].shape[:2], len(metadata['classes']))[0]
+    state['detections'] = []
+    state['counts'] = np.zeros(len(metadata['classes']), dtype=np.int64)
+    state['blank'] = []  # Per tile: skipped by the blank filter
+    for start in range(0, len(slices), batch_size):
+        batch = slices[start:start + batch_size]
+        blank = blank_tiles(batch, metadata.get('blank_filter'))
+        digests = None
+        if shared is not None and cache is not None:
+            digests = tissue_only(shared.digests(start, start + len(batch)), blank)
+        detections = run_filtered(batch, blank, empty, lambda tiles: run_cached(cache, namespace, tiles, run, digests=digests))
+        state['detections'].extend(detections)
+        for d in detections:
+            state['counts'] += d['counts']
+        state['blank'].extend([False] * len(batch) if blank is None else blank.tolist())
+    return state
+
+
+def infer_regions(states, **kwargs):
+    """
+    Pipeline stage 2 for several capture regions of one frame (see app.py): the tiles of all the regions go through
+    the model together, in the same micro-batches, then each region's state gets its own tiles' results.
+    kwargs['shared_tiles'] holds the tiles of all the regions (tile_cache.SharedTiles), if given.
+    """
+    if len({state['slices'][0].shape for state in states}) > 1:
+        # A region smaller than a tile has tiles of its own shape, which cannot share a batch
+        return [infer(state, **kwargs) for state in states]
+
+    merged = infer({'slices': [s for state in states for s in state['slices']],
+                    'shared_tiles': kwargs.get('shared_tiles')}, **kwargs)
+    start = 0
+    for state in states:
+        end = start + len(state['slices'])
+        state['detections'], state['blank'] = merged['detections'][start:end], merged['blank'][start:end]
+        state['counts'] = np.zeros(len(kwargs['metadata']['classes']), dtype=np.int64)
+        for d in state['detections']:
+            state['counts'] += d['counts']
+        start = end
+    return states
+
+
+def render(state, **kwargs):
+    """Pipeline stage 3: blend the masks of all tiles onto the frame in one pass and count cells"""
+    n_classes = len(kwargs['metadata']['classes'])
+    frame = state['frame']
+    detections = state['detections']
+
+    # Tile label maps -> one label map for the whole frame, written in place (no stacked copy of all tiles)
+    rows, cols, tile_h, tile_w = state['grid_shape']
+    labels = np.empty((rows * tile_h, cols * tile_w), dtype=np.uint8)
+    labels_grid = labels.reshape(rows, tile_h, cols, tile_w)
+    for k, d in enumerate(detections):
+        labels_grid[k // cols, :, k % cols, :] = d['labels']
+
+    # Grid moved with a pan (see pan_tracker.py): the masks move with it. The strips outside the grid have no masks
+    # and tiles hanging over the bottom/right edge of the displayed frame are cut off
+    origin_y, origin_x = state['origin']
+    if labels.shape != frame.shape[:2] or origin_y or origin_x:
+        shifted = np.zeros(frame.shape[:2], dtype=np.uint8)
+        target = shifted[origin_y:origin_y + labels.shape[0], origin_x:origin_x + labels.shape[1]]
+        target[...] = labels[:target.shape[0], :target.shape[1]]
+        labels = shifted
+
+    # Label -> colour lookup table (label = n_classes - class, 0 = background)
+    lut = np.zeros((n_classes + 1, 3), dtype=np.uint16)
+    for c in range(n_classes):
+        lut[n_classes - c] = CLASS_COLORS[c]
+
+    # Alpha blend in uint16 fixed point, only where there are masks
+    alpha = int(MASK_ALPHA * 256)
+    seg_mask = frame.copy()
+    masked = labels > 0
+    seg_mask[masked] = ((seg_mask[masked].astype(np.uint16) * (256 - alpha) + lut[labels[masked]] * alpha) >> 8).astype(np.uint8)
+
+    counts = state['counts']
+    num_pos = counts[0]
+    num_pos_neg = counts[0] + counts[1]
 
     text = '(+) {:.2f} %\n'.format(num_pos / num_pos_neg * 100 if num_pos_neg > 0 else 0)
     text += '(+) cells: {}\n'.format(num_pos)
     text += '(-) cells: {}\n'.format(num_pos_neg - num_pos)
+    if kwargs['metadata'].get('blank_filter'):
+        text += '({})\n'.format(blank_summary(sum(state['blank']), len(detections)))
+
+    return seg_mask, text
+
+
+def tile_record(output, **kwargs):
+    """JSON-able result of one tile (for batch_process.py). List-valued fields are summed over tiles for `summarize`"""
+    n_classes = len(kwargs['metadata']['classes'])
+    area = np.bincount(output['labels'].ravel(), minlength=n_classes + 1)  # Label = n_classes - class
+    return {'counts': output['counts'].tolist(), 'area_px': area[n_classes:0:-1].tolist()}
+
+
+def summarize(totals, n_tiles, n_blank=0, **kwargs):
+    """Aggregate over all tiles of an image, from the summed list fields of `tile_record` (blank tiles add nothing)"""
+    classes = kwargs['metadata']['classes']
+    counts = totals.get('counts', [0] * len(classes))
+    area_px = totals.get('area_px', [0] * len(classes))
+    num_pos, num_neg = counts[0], counts[1]
+    return {'tiles': n_tiles, 'blank_tiles': n_blank, 'counts': dict(zip(classes, counts)),
+            'area_px': dict(zip(classes, area_px)),
+            'positive_percent': round(num_pos / (num_pos + num_neg) * 100, 2) if num_pos + num_neg > 0 else 0}
+
+
+def process_region(region, **kwargs):
+
+    frame = kwargs.pop('frame', None)  # Already-grabbed BGR frame (skips the screen grab)
+    if frame is None:
+        frame = grab_region(region)
 
-    return seg_mask.astype(np.uint8), text
+    state = prepare(frame, **kwargs)
+    state = infer(state, **kwargs)
+    return render(state, **kwargs)
@@ -1,34 +1,127 @@
-import mss
 import numpy as np
-import cv2
 
-from utils import extract_tiles
+from utils import extract_tiles, crop_to_tiles, grab_region, micro_batch_size, TileBatchBuffer
+from tile_cache import run_cached, cache_namespace
+from tile_filter import blank_tiles, run_filtered, tissue_only, summary as blank_summary
+
+
+def infer_tiles(model, slices, input_buffer=None):
+    """Runs the ONNX classifier on tiles (list or tile grid) and returns one softmax vector per tile"""
+    if input_buffer is None:
+        input_buffer = TileBatchBuffer()
+    batch = input_buffer.fill(slices)
+
+    confs = model.run_batch(batch)  # OnnxEngine (output buffer is reused, hence the copies below)
+
+    return [c.copy() for c in confs]
+
+
+def run_tiles(slices, **kwargs):
+    """Per-tile outputs of a list of tiles, in this process (see inference_pool.py for the multi-process version)"""
+    return infer_tiles(kwargs['model'], slices, kwargs.get('input_buffer'))
+
+
+def blank_output(metadata):
+    """Synthetic softmax vector of a tile the blank filter skipped: all on the blank class ("Blank space" by default)"""
+    blank_class = (metadata.get('blank_filter') or {}).get('class', 'Blank space')
+    if blank_class not in metadata['classes']:
+        raise ValueError(f"blank_filter: the model has no '{blank_class}' class")
+    output = np.zeros(len(metadata['classes']), dtype=np.float32)
+    output[metadata['classes'].index(blank_class)] = 1
+    return output
+
+
+def tile_output_spec(tile_shape, **kwargs):
+    """(shape, dtype) of one tile's output, so worker processes can write it to shared memory"""
+    return (len(kwargs['metadata']['classes']),), np.float32
+
+
+def prepare(frame, **kwargs):
+    """
+    Pipeline stage 1: crop the grabbed frame and split it into tiles.
+    The tile grid starts at kwargs['grid_origin'] ((y, x), see pan_tracker.py) if given, the displayed frame does not move.
+    kwargs['shared_tiles'] (tile_cache.SharedTiles of that grid) is used instead when several models/regions share the frame.
+    """
+    tile_size = kwargs['metadata']['tile_size']
+    origin_y, origin_x = kwargs.get('grid_origin') or (0, 0)
+
+    shared = kwargs.get('shared_tiles')
+    slices = shared.slices if shared is not None else extract_tiles(frame[origin_y:, origin_x:], tile_size)
+    frame = crop_to_tiles(frame, tile_size)
+
+    return {'frame': frame, 'slices': slices, 'origin': (origin_y, origin_x), 'shared_tiles': shared}
 
-def process_region(region, **kwargs):
 
+def infer(state, **kwargs):
+    """
+    Pipeline stage 2: per-tile softmax vectors (only tiles missing from the cache go through the model).
+    Tiles go through the model in micro-batches (see utils.micro_batch_size) and the sum of the confidences
+    is kept as they come in, so memory does not grow with the capture size.
+    Tiles flagged by the model's "blank_filter" (see tile_filter.py) skip the model and are left out of the sum.
+    """
     metadata = kwargs['metadata']
-    model = kwargs['model']
+    cache = kwargs.get('cache')  # Optional TileCache
+    pool = kwargs.get('pool')  # Optional InferencePool (worker processes)
+    # kwargs may also hold an 'input_buffer' (TileBatchBuffer reused across frames)
 
-    ###
+    run = lambda s: pool.run(s) if pool is not None and len(s) >= pool.min_batch else run_tiles(s, **kwargs)
+    namespace = cache_namespace(metadata, kwargs['additional_configs'])
 
-    tile_size = metadata['tile_size']
+    blank_conf = blank_output(metadata) if metadata.get('blank_filter') else None
 
-    with mss.mss() as sct:
-        screenshot = sct.grab(region)
+    slices = state['slices']
+    shared = state.get('shared_tiles')  # Tile digests shared with the other models on this frame
+    batch_size = micro_batch_size(metadata, slices[0].shape) * (pool.n_workers if pool is not None else 1)
+    state['confs'] = []
+    state['conf_sum'] = np.zeros(len(metadata['classes']), dtype=np.float64)
+    state['blank'] = []  # Per tile: skipped by the blank filter
+    for start in range(0, len(slices), batch_size):
+        batch = slices[start:start + batch_size]
+        blank = blank_tiles(batch, metadata.get('blank_filter'))
+        digests = None
+        if shared is not None and cache is not None:
+            digests = tissue_only(shared.digests(start, start + len(batch)), blank)
+        confs = run_filtered(batch, blank, blank_conf, lambda tiles: run_cached(cache, namespace, tiles, run, digests=digests))
+        state['confs'].extend(confs)
 
-    frame = np.array(screenshot, dtype=np.uint8)
-    frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
-    frame = frame[:max((frame.shape[0] // tile_size) * tile_size, tile_size),
-            :max((frame.shape[1] // tile_size) * tile_size, tile_size), :]
+        tissue = confs if blank is None else [c for c, b in zip(confs, blank) if not b]
+        if tissue:
+            state['conf_sum'] += np.sum(tissue, axis=0)
+        state['blank'].extend([False] * len(batch) if blank is None else blank.tolist())
+    return state
 
-    slices = extract_tiles(frame, tile_size)
 
-    batch = np.divide(np.array(slices), 255)
+def infer_regions(states, **kwargs):
+    """
+    Pipeline stage 2 for several capture regions of one frame (see app.py): the tiles of all the regions go through
+    the model together, in the same micro-batches, then each region's state gets its own tiles' results.
+    kwargs['shared_tiles'] holds the tiles of all the regions (tile_cache.SharedTiles), if given.
+    """
+    if len({state['slices'][0].shape for state in states}) > 1:
+        # A region smaller than a tile has tiles of its own shape, which cannot share a batch
+        return [infer(state, **kwargs) for state in states]
 
-    inputs = {model.get_inputs()[0].name: batch.astype(np.float32)}
-    confs = model.run(None, inputs)[0]
+    merged = infer({'slices': [s for state in states for s in state['slices']],
+                    'shared_tiles': kwargs.get('shared_tiles')}, **kwargs)
+    start = 0
+    for state in states:
+        end = start + len(state['slices'])
+        state['confs'], state['blank'] = merged['confs'][start:end], merged['blank'][start:end]
+        state['conf_sum'] = np.zeros(len(kwargs['metadata']['classes']), dtype=np.float64)
+        tissue = [c for c, b in zip(state['confs'], state['blank']) if not b]
+        if tissue:
+            state['conf_sum'] += np.sum(tissue, axis=0)
+        start = end
+    return states
 
-    confs = np.mean(confs, axis=0)
+
+def render(state, **kwargs):
+    """Pipeline stage 3: aggregate the tile predictions into the text shown on the GUI"""
+    metadata = kwargs['metadata']
+
+    # Mean over the tissue tiles (an all-glass capture is just blank)
+    n_tissue = len(state['confs']) - sum(state['blank'])
+    confs = state['conf_sum'] / n_tissue if n_tissue else blank_output(metadata)
     top_3_idx = np.argsort(-confs)[:3]
 
     res = ''
@@ -46,4 +139,41 @@ def process_region(region, **kwargs):
         res += '{}: {:.4f}\n'.format(metadata['classes'][idx], confs[idx])
     print(res)
 
-    return frame, res
\ No newline at end of file
+    if metadata.get('blank_filter'):
+        res += '({})\n'.format(blank_summary(sum(state['blank']), len(state['confs'])))
+
+    return state['frame'], res
+
+
+def tile_record(output, **kwargs):
+    """JSON-able result of one tile (for batch_process.py). List-valued fields are summed over tiles for `summarize`"""
+    classes = kwargs['metadata']['classes']
+    idx = int(np.argmax(output))
+    return {'class': classes[idx], 'conf': round(float(output[idx]), 4), 'probs': [round(float(p), 4) for p in output]}
+
+
+def summarize(totals, n_tiles, n_blank=0, **kwargs):
+    """
+    Aggregate over all tiles of an image, from the summed list fields of `tile_record` (of the tissue tiles only,
+    the `n_blank` tiles skipped by the blank filter are only counted)
+    """
+    metadata = kwargs['metadata']
+    classes = metadata['classes']
+    n_tissue = n_tiles - n_blank
+    if not n_tissue:
+        return {'tiles': n_tiles, 'blank_tiles': n_blank, 'mean_probs': {c: 0.0 for c in classes}, 'top_3': []}
+    mean = np.asarray(totals['probs']) / n_tissue
+    return {'tiles': n_tiles, 'blank_tiles': n_blank,
+            'mean_probs': {c: round(float(p), 4) for c, p in zip(classes, mean)},
+            'top_3': [classes[i] for i in np.argsort(-mean)[:3]]}
+
+
+def process_region(region, **kwargs):
+
+    frame = kwargs.pop('frame', None)  # Already-grabbed BGR frame (skips the screen grab)
+    if frame is None:
+        frame = grab_region(region)
+
+    state = prepare(frame, **kwargs)
+    state = infer(state, **kwargs)
+    return render(state, **kwargs)
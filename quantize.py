@@ -0,0 +1,279 @@
+"""
+Reduced-precision (INT8) variants of the ONNX models, and a report to check them against fp32 before switching.
+
+Precisions (the "precision" field of a model's metadata, also picked in the GUI next to Start):
+- fp32: the model as downloaded / exported
+- int8_dynamic: int8 weights, activations quantized on the fly. Needs no calibration, built on first load if missing
+- int8_static: int8 weights and activations, with activation ranges calibrated on recorded tiles (built by this script)
+
+Applies to the HuggingFace ONNX classifiers and to the ONNX export of YOLO models (metadata "engine": "onnx").
+Variants are cached in the app's cache folder (like the optimized graphs and the YOLO exports), keyed by the fp32
+model file, so they are rebuilt when it changes.
+
+Tiles come from recordings (see frame_recorder.py, a folder of recordings works too) and/or images. Blank tiles
+(see tile_filter.py) and repeated tiles are dropped, the rest is split into a calibration set and a held-out set.
+The report runs fp32 and every variant on the held-out tiles: latency, and how often each `tile_record` field
+(class, cell counts, ...) matches fp32, with the mean absolute difference of numeric fields.
+
+    python quantize.py metadata/tumor_compact_vgg.json --tiles recordings/ slide_export.png
+    python quantize.py metadata/mib_yolo.json --tiles recordings/session1 --precisions int8_static --max-tiles 400
+"""
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from utils import cache_path, download_model, extract_tiles, micro_batch_size, TileBatchBuffer
+
+
+PRECISIONS = ('fp32', 'int8_dynamic', 'int8_static')
+
+
+def quantized_model_path(model_path, precision):
+    """Cache path of the `precision` variant of the fp32 model file at `model_path`"""
+    import onnxruntime as ort
+
+    stat = os.stat(model_path)
+    key = json.dumps([os.path.abspath(model_path), stat.st_size, stat.st_mtime, ort.__version__])
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return cache_path('quantized', '{}_{}_{}.onnx'.format(os.path.splitext(os.path.basename(model_path))[0], digest, precision))
+
+
+def _preprocess(model_path, out_path):
+    # ONNX Runtime's recommended pre-processing (shape inference + graph cleanup). Best effort: YOLO exports do not
+    # get through symbolic shape inference, and quantizing the model as is still works
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    try:
+        quant_pre_process(model_path, out_path, skip_symbolic_shape=True)
+        return out_path
+    except Exception as e:
+        print(f"Pre-processing skipped ({e})")
+        return model_path
+
+
+def quantize_dynamic_model(model_path, out_path):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    quantize_dynamic(model_path, out_path, weight_type=QuantType.QInt8)
+    return out_path
+
+
+def quantize_static_model(model_path, out_path, tiles, input_buffer, batch_size=8):
+    """tiles: calibration tiles (uint8 BGR), converted to the model's input with `input_buffer` (a TileBatchBuffer)"""
+    import onnxruntime as ort
+    from onnxruntime.quantization import quantize_static, CalibrationDataReader, QuantFormat, QuantType
+
+    input_name = ort.InferenceSession(model_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+
+    class TileReader(CalibrationDataReader):
+        def __init__(self):
+            self._batches = iter(range(0, len(tiles), batch_size))
+
+        def get_next(self):
+            start = next(self._batches, None)
+            if start is None:
+                return None
+            return {input_name: input_buffer.fill(tiles[start:start + batch_size]).copy()}
+
+    preprocessed = _preprocess(model_path, out_path + '.pre.onnx')
+    try:
+        # QDQ with uint8 activations / int8 per-channel weights: ONNX Runtime's recommended setup for CPUs
+        quantize_static(preprocessed, out_path, TileReader(), quant_format=QuantFormat.QDQ, per_channel=True,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    finally:
+        if preprocessed != model_path:
+            os.remove(preprocessed)
+    return out_path
+
+
+def precision_model_path(model_path, precision, progress=None):
+    """
+    Model file to load for `precision` (see PRECISIONS): the fp32 file itself, or its cached variant.
+    A missing int8_dynamic variant is built here, int8_static ones need calibration tiles (run this script).
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}', expected one of {PRECISIONS}")
+    if precision == 'fp32':
+        return model_path
+
+    path = quantized_model_path(model_path, precision)
+    if not os.path.exists(path):
+        if precision != 'int8_dynamic':
+            raise FileNotFoundError(f"No {precision} variant of {model_path} yet. Build it with: "
+                                    f"python quantize.py <metadata file> --tiles <recordings/images>")
+        if progress is not None:
+            progress('Quantizing')
+        quantize_dynamic_model(model_path, path)
+    return path
+
+
+def fp32_model_path(metadata):
+    """The fp32 ONNX file the variants of a model are made from (the YOLO export for YOLO models)"""
+    model_path = download_model(metadata)
+    if metadata['model'] == 'YOLO':
+        from yolo_engine import export_yolo
+        model_path = export_yolo(model_path, metadata['tile_size'], 'onnx')
+    return model_path
+
+
+def model_input_buffer(metadata):
+    # How tiles are fed to each kind of model (see process_region_onnx.py / yolo_engine.py)
+    if metadata['model'] == 'YOLO':
+        return TileBatchBuffer(channels_first=True, flip_channels=True)
+    return TileBatchBuffer()
+
+
+def load_tiles(paths, metadata, max_tiles=1000):
+    """
+    Up to `max_tiles` distinct, non-blank tiles (copies) from recordings and/or images, evenly spread over all of them.
+    """
+    import cv2
+    from frame_recorder import INDEX_FILE, read_recording, recorded_frame
+    from tile_cache import tile_digest
+    from tile_filter import blank_tiles
+
+    def frames(path):
+        if os.path.isdir(path):
+            if os.path.exists(os.path.join(path, INDEX_FILE)):
+                index, store = read_recording(path)
+                for entry in index:
+                    yield recorded_frame(entry, store)
+            else:
+                for name in sorted(os.listdir(path)):
+                    yield from frames(os.path.join(path, name))
+        elif path.lower().endswith(('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp')):
+            image = cv2.imread(path, cv2.IMREAD_COLOR)
+            if image is None:
+                raise FileNotFoundError(path)
+            yield image
+
+    tiles, seen = [], set()
+    for path in paths:
+        for frame in frames(path):
+            if min(frame.shape[:2]) < metadata['tile_size']:
+                continue
+            frame_tiles = extract_tiles(frame, metadata['tile_size'])
+            blank = blank_tiles(frame_tiles, metadata.get('blank_filter'))
+            for k, tile in enumerate(frame_tiles):
+                digest = tile_digest(tile)
+                if digest not in seen and (blank is None or not blank[k]):
+                    seen.add(digest)
+                    tiles.append(tile)
+
+    if len(tiles) > max_tiles:
+        tiles = [tiles[int(i)] for i in np.linspace(0, len(tiles) - 1, max_tiles)]
+    return [np.ascontiguousarray(t) for t in tiles]
+
+
+def split_tiles(tiles, holdout=0.3, seed=0):
+    """(calibration tiles, held-out tiles), shuffled the same way every run"""
+    order = np.random.default_rng(seed).permutation(len(tiles))
+    n_holdout = max(1, int(len(tiles) * holdout))
+    return [tiles[i] for i in order[n_holdout:]], [tiles[i] for i in order[:n_holdout]]
+
+
+def run_precision(metadata, precision, tiles):
+    """Runs the model at `precision` over `tiles` in micro-batches: (tile records, seconds per batch, model file size)"""
+    from utils import load_model
+
+    info = dict(metadata, precision=precision, inference_workers=0)
+    res = load_model(info)
+    backend = importlib.import_module(res['process_region_func'].__module__)
+    kwargs = {'model': res['model'], 'metadata': info, 'additional_configs': info['additional_configs'],
+              'input_buffer': TileBatchBuffer()}
+
+    batch_size = micro_batch_size(info, tiles[0].shape)
+    backend.run_tiles(tiles[:batch_size], **kwargs)  # Warm-up at the real batch size
+
+    records, times = [], []
+    for start in range(0, len(tiles), batch_size):
+        batch_start = time.perf_counter()
+        outputs = backend.run_tiles(tiles[start:start + batch_size], **kwargs)
+        times.append(time.perf_counter() - batch_start)
+        records.extend(backend.tile_record(output, **kwargs) for output in outputs)
+
+    model_file = res['model'].model_path if metadata['model'] == 'YOLO' else res['model_path']
+    return records, times, os.path.getsize(model_file)
+
+
+def compare_records(reference, records):
+    """Per tile_record field: share of tiles matching the reference exactly, and mean abs difference if numeric"""
+    comparison = {}
+    for key in reference[0]:
+        ref_values = [r[key] for r in reference]
+        values = [r[key] for r in records]
+        field = {'match': round(float(np.mean([a == b for a, b in zip(ref_values, values)])), 4)}
+        if not isinstance(ref_values[0], str):
+            field['mean_abs_diff'] = round(float(np.mean(np.abs(np.subtract(values, ref_values, dtype=np.float64)))), 4)
+        comparison[key] = field
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('metadata', help='model metadata file (e.g. metadata/tumor_compact_vgg.json)')
+    parser.add_argument('--tiles', nargs='+', required=True, help='recordings (or folders of them) and/or images')
+    parser.add_argument('--precisions', nargs='+', default=[p for p in PRECISIONS if p != 'fp32'],
+                        choices=PRECISIONS[1:], help='variants to build and compare against fp32')
+    parser.add_argument('--weights', help='local weights file to use instead of the one in the metadata')
+    parser.add_argument('--max-tiles', type=int, default=1000)
+    parser.add_argument('--holdout', type=float, default=0.3, help='share of the tiles kept out of calibration')
+    parser.add_argument('--report', help='where to write the report (default: quantization_<metadata name>.json)')
+    args = parser.parse_args()
+
+    with open(args.metadata) as f:
+        metadata = json.load(f)
+    if args.weights:
+        metadata = dict(metadata, repo=os.path.abspath(args.weights), repo_src='Local')
+    if metadata['model'] == 'YOLO':
+        metadata = dict(metadata, engine='onnx')  # Variants are made from (and run as) the ONNX export
+
+    tiles = load_tiles(args.tiles, metadata, args.max_tiles)
+    if len(tiles) < 2:
+        raise SystemExit(f"Need at least 2 distinct non-blank tiles of {metadata['tile_size']} px, found {len(tiles)}")
+    calibration, holdout = split_tiles(tiles, args.holdout)
+    print(f"{len(tiles)} tiles: {len(calibration)} for calibration, {len(holdout)} held out")
+
+    model_path = fp32_model_path(metadata)
+    for precision in args.precisions:
+        path = quantized_model_path(model_path, precision)
+        print(f"Building {precision} -> {path}")
+        if precision == 'int8_dynamic':
+            quantize_dynamic_model(model_path, path)
+        else:
+            quantize_static_model(model_path, path, calibration, model_input_buffer(metadata))
+
+    reference, reference_times, reference_size = run_precision(metadata, 'fp32', holdout)
+    report = {'metadata': os.path.abspath(args.metadata), 'fp32_model': model_path, 'holdout_tiles': len(holdout),
+              'calibration_tiles': len(calibration), 'precisions': {}}
+    for precision in ['fp32'] + args.precisions:
+        records, times, size = (reference, reference_times, reference_size) if precision == 'fp32' else \
+            run_precision(metadata, precision, holdout)
+        report['precisions'][precision] = {
+            'ms_per_tile': round(sum(times) / len(holdout) * 1000, 3),
+            'p50_batch_ms': round(float(np.percentile(times, 50)) * 1000, 2),
+            'speedup': round(sum(reference_times) / sum(times), 2),
+            'model_mb': round(size / 1024 ** 2, 1),
+            'vs_fp32': compare_records(reference, records),
+        }
+
+    print('\n{:<14}{:>12}{:>9}{:>10}  {}'.format('precision', 'ms/tile', 'speedup', 'size MB', 'match vs fp32'))
+    for precision, r in report['precisions'].items():
+        matches = ', '.join('{} {:.1%}'.format(k, v['match']) + (' (±{:g})'.format(v['mean_abs_diff']) if 'mean_abs_diff' in v else '')
+                            for k, v in r['vs_fp32'].items())
+        print('{:<14}{:>12.2f}{:>9.2f}{:>10.1f}  {}'.format(precision, r['ms_per_tile'], r['speedup'], r['model_mb'], matches))
+
+    report_path = args.report or 'quantization_{}.json'.format(os.path.splitext(os.path.basename(args.metadata))[0])
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport: {report_path}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,24 @@
+def union_region(regions):
+    """Smallest region (screen coordinates, like the regions mss grabs) containing all of `regions`"""
+    regions = list(regions)
+    left = min(r['left'] for r in regions)
+    top = min(r['top'] for r in regions)
+    right = max(r['left'] + r['width'] for r in regions)
+    bottom = max(r['top'] + r['height'] for r in regions)
+    return {'left': left, 'top': top, 'width': right - left, 'height': bottom - top}
+
+
+def crop_regions(frame, union, regions):
+    """
+    {name: view of the frame} for each of `regions` ({name: region}), where `frame` is one grab of `union`.
+    Screen coordinates are scaled to the frame's pixels (a grab on a Retina display has twice as many).
+    """
+    scale_y = frame.shape[0] / union['height']
+    scale_x = frame.shape[1] / union['width']
+
+    crops = {}
+    for name, region in regions.items():
+        top = round((region['top'] - union['top']) * scale_y)
+        left = round((region['left'] - union['left']) * scale_x)
+        crops[name] = frame[top:top + round(region['height'] * scale_y), left:left + round(region['width'] * scale_x)]
+    return crops
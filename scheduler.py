@@ -0,0 +1,102 @@
+import os
+import time
+
+
+class FrameScheduler:
+    """
+    Decides how long the capture loop waits before submitting the next frame (replaces a fixed sleep).
+
+    Modes:
+    - 'Adaptive': aim for `target_fps`, but never submit frames faster than the slowest pipeline stage can take
+      them (they would only be dropped) and back off further while the process uses more than `cpu_ceiling` of
+      the machine's CPU.
+    - 'Max speed': no waiting at all.
+    - 'Fixed FPS': exactly `target_fps` (or as close as the pipeline allows).
+
+    In every mode the loop slows down to `idle_poll_interval` while paused (e.g. the app window is minimized) or once
+    the captured region has not changed for `idle_timeout` seconds, and speeds back up on the first change.
+    """
+
+    MODES = ('Adaptive', 'Max speed', 'Fixed FPS')
+
+    def __init__(self, mode='Adaptive', target_fps=10.0, cpu_ceiling=0.8, idle_timeout=5.0, idle_poll_interval=0.5):
+        self.mode = mode
+        self.target_fps = target_fps
+        self.cpu_ceiling = cpu_ceiling
+        self.idle_timeout = idle_timeout
+        self.idle_poll_interval = idle_poll_interval
+        self.paused = False
+
+        self.stage_times = {}  # Pipeline stage name -> smoothed time per frame (seconds)
+        self.cpu_usage = 0.0  # Smoothed fraction of total machine CPU used by this process
+        self.backoff = 1.0  # Multiplier on the frame interval applied while over the CPU ceiling
+
+        self._cpu_count = os.cpu_count() or 1
+        self._last_wall = time.perf_counter()
+        self._last_cpu = time.process_time()
+        self._last_change = time.perf_counter()
+
+    def configure(self, mode, target_fps):
+        if mode in self.MODES:
+            self.mode = mode
+        try:
+            target_fps = float(target_fps)
+            if target_fps > 0:
+                self.target_fps = target_fps
+        except (TypeError, ValueError):
+            pass  # Keep the previous target while the user is still typing
+
+    def report_stage_time(self, stage, seconds):
+        """Called by the pipeline stages with how long they took on a frame"""
+        previous = self.stage_times.get(stage, seconds)
+        self.stage_times[stage] = 0.8 * previous + 0.2 * seconds
+
+    @property
+    def stage_time(self):
+        """Smoothed time of the slowest pipeline stage, i.e. the fastest rate the pipeline can sustain"""
+        return max(self.stage_times.values(), default=0.0)
+
+    @property
+    def idle(self):
+        return self.paused or time.perf_counter() - self._last_change > self.idle_timeout
+
+    def _update_cpu_usage(self):
+        wall, cpu = time.perf_counter(), time.process_time()
+        if wall - self._last_wall >= 0.5:
+            usage = (cpu - self._last_cpu) / (wall - self._last_wall) / self._cpu_count
+            self.cpu_usage = 0.5 * self.cpu_usage + 0.5 * usage
+            self._last_wall, self._last_cpu = wall, cpu
+
+            if self.cpu_usage > self.cpu_ceiling:
+                self.backoff = min(self.backoff * 1.25, 10.0)
+            else:
+                self.backoff = max(self.backoff / 1.1, 1.0)
+
+    def interval(self):
+        """Target time between two submitted frames (seconds)"""
+        if self.idle:
+            return self.idle_poll_interval
+        if self.mode == 'Max speed':
+            return 0.0
+        if self.mode == 'Fixed FPS':
+            return 1 / self.target_fps
+        return max(1 / self.target_fps, self.stage_time) * self.backoff
+
+    def wait_time(self, frame_changed, loop_start):
+        """
+        Call at the end of every loop iteration (whether the frame was submitted or skipped). Returns how long to
+        sleep so that iterations are `interval()` apart. `loop_start` is the `time.perf_counter()` at its start.
+        """
+        now = time.perf_counter()
+        if frame_changed:
+            self._last_change = now
+        self._update_cpu_usage()
+
+        return max(0.0, self.interval() - (now - loop_start))
+
+    def summary(self):
+        if self.idle:
+            return 'idle'
+        interval = self.interval()
+        return '{}: {} fps, CPU {:.0f}%'.format(
+            self.mode, 'max' if interval == 0 else '{:.1f}'.format(1 / interval), self.cpu_usage * 100)
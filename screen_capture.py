@@ -0,0 +1,178 @@
+import threading
+import time
+
+import numpy as np
+
+
+class CapturedFrame:
+    """
+    A frame handed out by `ScreenCaptureProducer.latest()`. `bgr` is a zero-copy view into the producer's ring
+    buffer; the slot is not written to again until `release()` is called (copy anything that must outlive it).
+    `timestamp` is when the grab finished (time.time()), `grab_seconds` how long the grab + copy took.
+    """
+
+    def __init__(self, producer, generation, slot, seq, timestamp, bgr, grab_seconds=0.0):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.bgr = bgr
+        self.grab_seconds = grab_seconds
+
+        self._producer = producer
+        self._generation = generation
+        self._slot = slot
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._producer._release(self._generation, self._slot)
+
+
+class ScreenCaptureProducer:
+    """
+    Long-lived screen grabber running on its own thread.
+
+    One `mss` handle is kept open for the lifetime of the producer and every grab is copied straight from mss'
+    raw BGRA buffer into one of `ring_size` preallocated numpy buffers (no per-frame allocations on our side).
+    `latest()` hands out a zero-copy BGR view (the first 3 channels of the BGRA buffer) of the newest frame.
+
+    Slots held by consumers (frames not yet released) are never overwritten. If every slot is held, the producer
+    waits for one to be released, so the ring size bounds how many frames can be in flight at once.
+    """
+
+    def __init__(self, region=None, ring_size=3, max_fps=30):
+        assert ring_size >= 2, 'Need one slot for the latest frame and one to write to'
+        self.ring_size = ring_size
+        self.max_fps = max_fps
+
+        self.frames_grabbed = 0
+        self.error = None
+
+        self._region = region
+        self._buffers = []  # Preallocated (height, width, 4) uint8 BGRA buffers
+        self._latest_slot = None
+        self._latest_seq = 0
+        self._latest_time = None
+        self._latest_grab_seconds = 0.0
+        self._holds = [0] * ring_size  # Number of unreleased CapturedFrames per slot
+        self._generation = 0  # Bumped whenever the buffers are reallocated
+        self._consumed_seq = 0
+
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='ScreenCaptureProducer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def set_region(self, region):
+        with self._cond:
+            if region != self._region:
+                self._region = dict(region) if region is not None else None
+                self._latest_slot = None  # Frames of the old region are stale
+                self._cond.notify_all()
+
+    def set_max_fps(self, max_fps):
+        """Changes the grab rate (e.g. to follow the consumer's rate), taking effect on the frame being waited for"""
+        with self._cond:
+            if max_fps != self.max_fps:
+                self.max_fps = max_fps
+                self._cond.notify_all()
+
+    def _allocate(self, height, width):
+        # Called with the lock held, and only when the region size changed
+        # (frames still held by consumers keep the old buffers alive, so they stay valid)
+        self._buffers = [np.empty((height, width, 4), dtype=np.uint8) for _ in range(self.ring_size)]
+        self._latest_slot = None
+        self._holds = [0] * self.ring_size
+        self._generation += 1
+
+    def _free_slot(self):
+        for i in range(self.ring_size):
+            if i != self._latest_slot and self._holds[i] == 0:
+                return i
+
+    def _release(self, generation, slot):
+        with self._cond:
+            if generation == self._generation:
+                self._holds[slot] -= 1
+                self._cond.notify_all()
+
+    def _run(self):
+        try:
+            import mss
+
+            with mss.mss() as sct:  # mss handles are not thread safe, so it is created on the capture thread
+                while True:
+                    with self._cond:
+                        while self._running and self._region is None:
+                            self._cond.wait()
+                        if not self._running:
+                            return
+                        region = self._region
+
+                    start = time.perf_counter()
+                    screenshot = sct.grab(region)
+                    raw = np.frombuffer(screenshot.raw, dtype=np.uint8).reshape(screenshot.height, screenshot.width, 4)
+
+                    with self._cond:
+                        if region != self._region:
+                            continue  # Region changed mid-grab
+                        if not self._buffers or self._buffers[0].shape != raw.shape:
+                            self._allocate(*raw.shape[:2])
+
+                        self._cond.wait_for(lambda: not self._running or self._free_slot() is not None)
+                        if not self._running:
+                            return
+                        if region != self._region:
+                            continue
+                        slot = self._free_slot()
+                        np.copyto(self._buffers[slot], raw)
+
+                        self._latest_slot = slot
+                        self._latest_seq += 1
+                        self._latest_time = time.time()
+                        self._latest_grab_seconds = time.perf_counter() - start
+                        self.frames_grabbed += 1
+                        self._cond.notify_all()
+
+                    # Wait out the frame interval (cut short when stopped or when the rate changes)
+                    with self._cond:
+                        while self._running and self.max_fps:
+                            remaining = 1 / self.max_fps - (time.perf_counter() - start)
+                            if remaining <= 0:
+                                break
+                            self._cond.wait(remaining)
+        except Exception as e:
+            with self._cond:
+                self.error = e
+                self._running = False
+                self._cond.notify_all()
+
+    def latest(self, wait_new=True, timeout=None):
+        """
+        Returns a CapturedFrame for the newest frame, or None on timeout/stop. The caller must `release()` it.
+        With `wait_new`, blocks until a frame newer than the one previously returned is available.
+        """
+        with self._cond:
+            ready = lambda: not self._running or (
+                    self._latest_slot is not None and (not wait_new or self._latest_seq > self._consumed_seq))
+            if not self._cond.wait_for(ready, timeout=timeout) or self._latest_slot is None:
+                return None
+
+            slot = self._latest_slot
+            self._holds[slot] += 1
+            self._consumed_seq = self._latest_seq
+            return CapturedFrame(self, self._generation, slot, self._latest_seq, self._latest_time,
+                                 self._buffers[slot][:, :, :3], self._latest_grab_seconds)
@@ -0,0 +1,161 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def cache_namespace(metadata, additional_configs=None):
+    """Part of the cache key shared by every tile of a given model + config (precision and engine included)."""
+    configs = tuple(sorted((additional_configs or {}).items()))
+    return (metadata['repo'], metadata['model'], metadata['tile_size'], metadata.get('precision', 'fp32'),
+            metadata.get('engine'), configs)
+
+
+def tile_digest(tile):
+    """Fast content hash of a tile's pixels (tiles are usually non-contiguous views of the frame)."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(np.ascontiguousarray(tile).data)
+    h.update(repr(tile.shape).encode())
+    return h.digest()
+
+
+def nbytes_of(value):
+    """Rough memory footprint of a cached value (numpy arrays, tensors, or containers of them)."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if hasattr(value, 'element_size') and hasattr(value, 'numel'):  # torch tensor
+        return value.element_size() * value.numel()
+    if isinstance(value, dict):
+        return sum(nbytes_of(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(nbytes_of(v) for v in value)
+    return 64
+
+
+class TileCache:
+    """Bounded LRU cache of per-tile model outputs, keyed by tile content + model namespace."""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()  # key -> (value, nbytes)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, nbytes=None):
+        if nbytes is None:
+            nbytes = nbytes_of(value)
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_nbytes) = self._entries.popitem(last=False)
+                self.nbytes -= evicted_nbytes
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'nbytes': self.nbytes,
+        }
+
+    def summary(self):
+        return 'cache: {} hit / {} miss / {} evicted ({:.0f} MB)'.format(
+            self.hits, self.misses, self.evictions, self.nbytes / 1024 ** 2)
+
+
+class SharedTiles:
+    """
+    The tiles of one captured frame (for one tile size and grid origin) when several models run on the same capture
+    (see ClassificationThread): the frame is tiled once, and each tile is hashed for the cache at most once, by
+    whichever model gets to it first. Safe to share between threads.
+    """
+
+    def __init__(self, slices, _base=None, _offset=0):
+        self.slices = slices
+        self._base = _base or self  # Holds the digests (of every part)
+        self._offset = _offset  # Of these tiles in the base's
+        if _base is None:
+            self._digests = [None] * len(slices)
+            self._lock = threading.Lock()  # The other models wait for the tiles being hashed instead of hashing them too
+
+    def part(self, start, end):
+        """Tiles [start:end] of these (e.g. those of one capture region), sharing their digests"""
+        return SharedTiles(self.slices[start:end], self._base, self._offset + start)
+
+    def digests(self, start, end):
+        """tile_digest of tiles [start:end]"""
+        base = self._base
+        start, end = self._offset + start, self._offset + min(end, len(self.slices))
+        with base._lock:
+            for i in range(start, end):
+                if base._digests[i] is None:
+                    base._digests[i] = tile_digest(base.slices[i])
+            return base._digests[start:end]
+
+
+def run_cached(cache, namespace, tiles, infer_fn, sizeof=nbytes_of, digests=None):
+    """
+    Returns per-tile outputs for `tiles`, only running `infer_fn` (list of tiles -> list of per-tile outputs)
+    on tiles that are not already cached. Identical tiles within one call (e.g. blank glass) are inferred once.
+    digests: the tiles' tile_digest, if already known (see SharedTiles)
+    """
+    if cache is None:
+        return list(infer_fn(tiles))
+
+    if digests is None:
+        digests = [tile_digest(t) for t in tiles]
+    keys = [(namespace, digest) for digest in digests]
+    outputs = [cache.get(k) for k in keys]
+
+    # Unique cache-miss keys -> index of the first tile that has that key
+    missing = {}
+    for i, out in enumerate(outputs):
+        if out is None and keys[i] not in missing:
+            missing[keys[i]] = i
+
+    if missing:
+        miss_idx = list(missing.values())
+        new_outputs = infer_fn([tiles[i] for i in miss_idx])
+        for i, out in zip(miss_idx, new_outputs):
+            cache.put(keys[i], out, sizeof(out))
+            missing[keys[i]] = out
+
+        for i, out in enumerate(outputs):
+            if out is None:
+                outputs[i] = missing[keys[i]]
+
+    return outputs
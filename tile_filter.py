@@ -0,0 +1,59 @@
+import numpy as np
+
+
+# Tiles are subsampled to about this many px per side before the blank check (a cheap check on a 1024 px tile)
+BLANK_SAMPLE_SIZE = 64
+
+
+def blank_tiles(tiles, settings):
+    """
+    Flags the tiles that are just glass / empty background, so they can skip the model. Vectorized over the tiles.
+
+    settings: the model metadata's "blank_filter" (None = no filtering), a tile is blank when all of these hold:
+    - max_saturation: mean HSV saturation (0-255) at or below this (H&E stained tissue is pink/purple)
+    - min_intensity: mean gray level (0-255) at or above this (glass is bright)
+    - max_std: standard deviation of the gray level at or below this (a bit of tissue in a corner raises it)
+    Returns a (len(tiles),) bool array, or None without settings.
+    """
+    if not settings or not tiles:
+        return None
+
+    step = max(1, max(tiles[0].shape[:2]) // BLANK_SAMPLE_SIZE)
+    sample = np.stack([t[::step, ::step, :3] for t in tiles])  # (N, h, w, 3) uint8
+
+    high = sample.max(axis=-1).astype(np.float32)
+    low = sample.min(axis=-1).astype(np.float32)
+    saturation = (high - low) * 255 / np.maximum(high, 1)
+    gray = sample.mean(axis=-1, dtype=np.float32)
+
+    axes = (1, 2)
+    return ((saturation.mean(axis=axes) <= settings.get('max_saturation', 255))
+            & (gray.mean(axis=axes) >= settings.get('min_intensity', 0))
+            & (gray.std(axis=axes) <= settings.get('max_std', 255)))
+
+
+def run_filtered(tiles, blank, blank_output, infer_fn):
+    """
+    Per-tile outputs of `tiles`, where only the tiles not flagged in `blank` go through `infer_fn` (list of tiles ->
+    list of per-tile outputs) and the blank ones all get `blank_output` (shared, treat it as read-only).
+    """
+    if blank is None or not blank.any():
+        return list(infer_fn(tiles))
+
+    outputs = [blank_output] * len(tiles)
+    tissue = np.flatnonzero(~blank)
+    if len(tissue):
+        for i, output in zip(tissue, infer_fn([tiles[i] for i in tissue])):
+            outputs[i] = output
+    return outputs
+
+
+def tissue_only(values, blank):
+    """The per-tile `values` (e.g. tile digests) of the tiles run_filtered sends to the model"""
+    if blank is None:
+        return values
+    return [v for v, b in zip(values, blank) if not b]
+
+
+def summary(n_blank, n_tiles):
+    return '{}/{} blank tiles skipped ({:.0f}%)'.format(n_blank, n_tiles, n_blank / max(n_tiles, 1) * 100)
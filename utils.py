@@ -1,5 +1,6 @@
 import os
 import sys
+import numpy as np
 
 # Always use this for accessing any local path
 def resource_path(relative_path):
@@ -9,79 +10,266 @@ def resource_path(relative_path):
         return os.path.join(sys._MEIPASS, relative_path)
     return os.path.join(os.path.abspath("."), relative_path)
 
-def extract_tiles(frame, tile_size):
-    slices = []
+# Always use this for files we generate at runtime (optimized/exported models etc.)
+def cache_path(*parts):
+    """Path inside the app's cache folder (REALTIME_GUI_CACHE env var, default ~/.cache/realtime-gui). Parent folders are created."""
+    root = os.environ.get('REALTIME_GUI_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'realtime-gui'))
+    path = os.path.join(root, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+def grab_region(region):
+    """Grabs `region` (mss-style dict with left/top/width/height) from the screen as a BGR uint8 frame"""
+    import mss
+    import cv2
+
+    with mss.mss() as sct:
+        screenshot = sct.grab(region)
+
+    frame = np.array(screenshot, dtype=np.uint8)
+    return cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+
+def crop_to_tiles(frame, tile_size):
+    """Crops the frame down to a whole number of tiles (frames smaller than a tile are kept as is)"""
+    return frame[:max((frame.shape[0] // tile_size) * tile_size, tile_size),
+           :max((frame.shape[1] // tile_size) * tile_size, tile_size), :]
 
+def tile_grid(frame, tile_size):
+    """
+    Zero-copy (rows, cols, tile_h, tile_w, channels) strided view of the frame's tiles (tile [i, j] is the i-th tile
+    down and j-th tile across). Any remainder at the right/bottom that does not fill a whole tile is left out.
+    """
     # capture_size > tile_size: split capture window into sub tiles
     # capture_size < tile_size: no splitting. use the capture window dimension.
     # - there is a message on gui telling user that choosing a capture size less than the trained tile size is not recommended...
+    tile_size_y = min(tile_size, frame.shape[0])
+    tile_size_x = min(tile_size, frame.shape[1])
+
+    rows = frame.shape[0] // tile_size_y
+    cols = frame.shape[1] // tile_size_x
+    stride_y, stride_x, stride_c = frame.strides
+
+    return np.lib.stride_tricks.as_strided(
+        frame,
+        shape=(rows, cols, tile_size_y, tile_size_x, frame.shape[2]),
+        strides=(tile_size_y * stride_y, tile_size_x * stride_x, stride_y, stride_x, stride_c),
+        writeable=False,
+    )
+
+def extract_tiles(frame, tile_size):
+    """Tiles of the frame in row-major order, as views into the frame (no copies)"""
+    grid = tile_grid(frame, tile_size)
+    return [grid[i, j] for i in range(grid.shape[0]) for j in range(grid.shape[1])]
+
+def fit_size(height, width, max_size):
+    """(height, width) scaled to fit in a max_size x max_size box, keeping the aspect ratio"""
+    scale = min(max_size / height, max_size / width)
+    return max(1, round(height * scale)), max(1, round(width * scale))
+
+def side_by_side(images):
+    """RGB images next to each other, the shorter ones padded with black at the bottom"""
+    height = max(image.shape[0] for image in images)
+    return np.hstack([np.pad(image, ((0, height - image.shape[0]), (0, 0), (0, 0))) for image in images])
+
+def to_display_rgb(frame, max_size):
+    """
+    BGR(A) frame -> contiguous RGB uint8 image fitting in max_size x max_size (what the GUI shows).
+    Meant to run on a worker thread so the GUI thread only has to wrap the result in a QImage.
+    """
+    import cv2
+
+    height, width = fit_size(frame.shape[0], frame.shape[1], max_size)
+    if (height, width) != frame.shape[:2]:
+        interpolation = cv2.INTER_AREA if height < frame.shape[0] else cv2.INTER_LINEAR
+        frame = cv2.resize(frame, (width, height), interpolation=interpolation)
+
+    return cv2.cvtColor(frame, cv2.COLOR_BGRA2RGB if frame.shape[2] == 4 else cv2.COLOR_BGR2RGB)
+
+
+# Defaults for the metadata's "max_batch_tiles" / "batch_memory_mb" (see micro_batch_size)
+MAX_BATCH_TILES = 64
+BATCH_MEMORY_MB = 256
+
+def micro_batch_size(metadata, tile_shape):
+    """
+    Tiles per model call, so memory stays flat however big the capture is: at most "max_batch_tiles", and few
+    enough that the float32 model input stays under "batch_memory_mb" (both optional in the metadata).
+    """
+    tile_bytes = int(np.prod(tile_shape)) * np.dtype(np.float32).itemsize
+    by_memory = int(metadata.get('batch_memory_mb', BATCH_MEMORY_MB) * 1024 ** 2) // tile_bytes
+    return max(1, min(metadata.get('max_batch_tiles', MAX_BATCH_TILES), by_memory))
+
 
-    tile_size_y = tile_size_x = tile_size
+class TileBatchBuffer:
+    """
+    Reusable float32 model-input buffer. `fill` converts uint8 tiles to float32 / 255 writing straight into the
+    buffer (no float64 temporaries, no intermediate uint8 batch), and only reallocates when a bigger batch or a
+    different tile shape comes along.
 
-    if frame.shape[0] < tile_size:
-        tile_size_y = frame.shape[0]
-    if frame.shape[1] < tile_size:
-        tile_size_x = frame.shape[1]
+    channels_first: lay the batch out as (N, C, H, W) instead of (N, H, W, C)
+    flip_channels: reverse the channel order (BGR -> RGB)
+    """
 
-    for i in range(frame.shape[0] // tile_size_y):
-        for j in range(frame.shape[1] // tile_size_x):
-            tile_slice = frame[
-                         (i * tile_size_y):((i * tile_size_y) + tile_size_y),
-                         (j * tile_size_x):((j * tile_size_x) + tile_size_x),
-                         :
-                         ]
-            slices.append(tile_slice)
+    def __init__(self, channels_first=False, flip_channels=False):
+        self.channels_first = channels_first
+        self.flip_channels = flip_channels
+        self._buffer = None
 
-    return slices
+    def _reserve(self, n, tile_shape):
+        h, w, c = tile_shape
+        shape = (c, h, w) if self.channels_first else (h, w, c)
+        if self._buffer is None or self._buffer.shape[1:] != shape or self._buffer.shape[0] < n:
+            self._buffer = np.empty((n,) + shape, dtype=np.float32)
+        return self._buffer[:n]
 
+    def _layout(self, tiles):
+        # Same memory layout as the buffer, as a view of the uint8 tiles (last 3 axes are h, w, c)
+        if self.flip_channels:
+            tiles = tiles[..., ::-1]
+        if self.channels_first:
+            tiles = np.moveaxis(tiles, -1, -3)
+        return tiles
 
-def load_model(model_info):
+    def fill(self, tiles):
+        """
+        tiles: a (rows, cols, h, w, c) grid from `tile_grid`, or a list of (h, w, c) uint8 tiles.
+        Returns an (N, ...) float32 view of the buffer, valid until the next `fill`.
+        """
+        if isinstance(tiles, np.ndarray) and tiles.ndim == 5:
+            rows, cols = tiles.shape[:2]
+            batch = self._reserve(rows * cols, tiles.shape[2:])
+            np.divide(self._layout(tiles), np.float32(255), out=batch.reshape((rows, cols) + batch.shape[1:]),
+                      dtype=np.float32)
+            return batch
+
+        batch = self._reserve(len(tiles), tiles[0].shape)
+        for k, tile in enumerate(tiles):
+            np.divide(self._layout(tile), np.float32(255), out=batch[k], dtype=np.float32)
+        return batch
+
+
+def download_model(model_info):
+    """
+    Makes sure the model's weights are on disk (downloading them from HuggingFace if needed) and returns their path.
+    Raises if the weights are missing or empty.
+    """
+    if model_info['repo_src'] == 'HuggingFace':
+        from huggingface_hub import hf_hub_download
+        model_path = hf_hub_download(repo_id=model_info['repo'], filename="model.onnx")  # Checks the download against the hub's etag
+    else:
+        model_path = resource_path(model_info['repo'])
+
+    if not os.path.isfile(model_path) or os.path.getsize(model_path) == 0:
+        raise FileNotFoundError(f"Model weights missing or empty: {model_path}")
+
+    return model_path
+
+
+def start_pool(res, model_info, progress):
+    """
+    Starts the worker processes of a loaded model if its metadata has "inference_workers" > 0 (CPU-only machines,
+    see inference_pool.py). Done after the in-process load so exports/optimized graphs are already cached for them.
+    """
+    n_workers = model_info.get('inference_workers', 0)
+    if n_workers > 0 and not res['using_gpu']:
+        progress('Starting workers for')
+        from inference_pool import InferencePool
+        res['pool'] = InferencePool(model_info, n_workers, sys.modules[res['process_region_func'].__module__])
+    return res
+
+
+def load_model(model_info, progress=None):
+    """progress: optional callback taking a short status string ('Downloading', 'Loading')"""
+
+    if progress is None:
+        progress = lambda status: None
 
     res = {
         'model': None,
         'process_region_func': None,
-        'using_gpu': False
+        'pipeline_funcs': None,  # (prepare, infer, render) stages of process_region, used by the pipelined thread
+        'using_gpu': False,
+        'model_path': None,  # Weights file on disk (used to estimate memory use, see model_registry.py)
+        'pool': None,  # InferencePool when the metadata asks for "inference_workers" (see inference_pool.py)
     }
 
-    if model_info['repo_src'] == 'HuggingFace':
-        if model_info['model'] == 'ONNX':
+    # ONNX models come from HuggingFace, YOLO weights are local (either works for both, see download_model)
+    if model_info['model'] == 'ONNX':
+
+        progress('Downloading')
+        model_path = download_model(model_info)
 
-            from huggingface_hub import hf_hub_download
+        progress('Loading')
+        import onnxruntime as ort
+
+        # Load ONNX model with GPU support if available
+        available_providers = ort.get_available_providers()
+        if 'CUDAExecutionProvider' in available_providers:
             # Import torch will preload necessary DLLs. It needs to be done before creating session.
-            # REQUIRED FOR GPU TO WORK
+            # REQUIRED FOR GPU TO WORK (and only imported then, torch is slow to import)
             import torch
-            import onnxruntime as ort
+            providers = ['CUDAExecutionProvider']
+        else:
+            providers = ['CPUExecutionProvider']
+
+        # "precision" in the metadata: 'fp32' (default) or a cached int8 variant of the model (see quantize.py)
+        from quantize import precision_model_path
+        model_path = precision_model_path(model_path, model_info.get('precision', 'fp32'), progress)
 
-            model_path = hf_hub_download(repo_id=model_info['repo'], filename="model.onnx")
+        # Session options, optimized-graph cache, IO binding and warm-up. Tuned per model in the metadata "onnx_runtime" block
+        from onnx_engine import OnnxEngine
+        tile_size = model_info['tile_size']
+        engine = OnnxEngine(model_path, providers, settings=model_info.get('onnx_runtime'),
+                            warmup_shape=(1, tile_size, tile_size, 3))
 
-            # Load ONNX model with GPU support if available
-            available_providers = ort.get_available_providers()
-            if 'CUDAExecutionProvider' in available_providers:
-                providers = ['CUDAExecutionProvider']
-            else:
-                providers = ['CPUExecutionProvider']
+        from process_region_onnx import process_region, prepare, infer, render
 
-            session = ort.InferenceSession(model_path, providers=providers)
+        res['model'] = engine
+        res['model_path'] = model_path
+        res['process_region_func'] = process_region
+        res['pipeline_funcs'] = (prepare, infer, render)
+        res['using_gpu'] = 'CUDAExecutionProvider' in available_providers
 
-            from process_region_onnx import process_region
+        return start_pool(res, model_info, progress)
 
-            res['model'] = session
-            res['process_region_func'] = process_region
-            res['using_gpu'] = 'CUDAExecutionProvider' in available_providers
+    elif model_info['model'] == 'YOLO':
+        model_path = download_model(model_info)
 
-            return res
+        progress('Loading')
+        from process_region_YOLO import process_region, prepare, infer, render
 
-    elif model_info['repo_src'] == 'Local':
+        # "engine" in the metadata: 'torch' (ultralytics, default), or 'onnx'/'openvino' to run an export of the
+        # weights with a fixed tile_size input (exported once and cached, see yolo_engine.py)
+        engine = model_info.get('engine', 'torch')
+        if engine in ('onnx', 'openvino'):
+            from yolo_engine import YoloExportedEngine
 
-        if model_info['model'] == 'YOLO':
+            providers = ['CPUExecutionProvider']
+            if engine == 'onnx':
+                import onnxruntime as ort
+                if 'CUDAExecutionProvider' in ort.get_available_providers():
+                    import torch  # Preloads the CUDA DLLs (see above)
+                    providers = ['CUDAExecutionProvider']
+
+            res['model'] = YoloExportedEngine(model_path, model_info['tile_size'], len(model_info['classes']),
+                                              backend=engine, providers=providers,
+                                              onnx_settings=model_info.get('onnx_runtime'),
+                                              precision=model_info.get('precision', 'fp32'),
+                                              **model_info.get('engine_settings', {}))
+            res['using_gpu'] = providers == ['CUDAExecutionProvider']
+        else:
+            if model_info.get('precision', 'fp32') != 'fp32':
+                raise ValueError(f"precision {model_info['precision']} needs the ONNX export of the model (\"engine\": \"onnx\")")
             from ultralytics import YOLO
             import torch
-            from process_region_YOLO import process_region
 
-            res['model'] = YOLO(resource_path(model_info['repo']))
-            res['process_region_func'] = process_region
+            res['model'] = YOLO(model_path)
             res['using_gpu'] = torch.cuda.is_available()
 
-            return res
+        res['model_path'] = model_path
+        res['process_region_func'] = process_region
+        res['pipeline_funcs'] = (prepare, infer, render)
+
+        return start_pool(res, model_info, progress)
 
     return res
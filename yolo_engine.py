@@ -0,0 +1,143 @@
+import hashlib
+import os
+import shutil
+
+import numpy as np
+import cv2
+
+from utils import cache_path, TileBatchBuffer
+
+
+def export_yolo(weights_path, tile_size, backend):
+    """
+    Exports YOLO weights once to ONNX or OpenVINO with a fixed tile_size x tile_size input and dynamic batch size.
+    The export is cached (keyed by the weights' content), so torch/ultralytics are only needed the first time.
+    Returns the path of the .onnx file / the OpenVINO .xml file.
+    """
+    with open(weights_path, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()[:16]
+    export_dir = os.path.dirname(cache_path('yolo_export', '{}_{}_{}'.format(digest, tile_size, backend), 'model.pt'))
+
+    exported = os.path.join(export_dir, 'model.onnx' if backend == 'onnx' else 'model.xml')
+    if os.path.exists(exported):
+        return exported
+
+    from ultralytics import YOLO
+
+    # Export from a copy inside the cache folder (ultralytics writes next to the weights, which may be read-only)
+    local_weights = os.path.join(export_dir, 'model.pt')
+    shutil.copyfile(weights_path, local_weights)
+
+    # dynamic=True gives a dynamic batch axis; every batch we send is tile_size x tile_size
+    out = YOLO(local_weights, task='segment').export(format=backend, imgsz=tile_size, dynamic=True, half=False)
+
+    if backend == 'openvino':
+        # Exported as a folder (model_openvino_model/model.xml + .bin)
+        for f in os.listdir(out):
+            shutil.move(os.path.join(out, f), os.path.join(export_dir, f))
+        shutil.rmtree(out, ignore_errors=True)
+
+    os.remove(local_weights)
+    return exported
+
+
+def decode_segmentation(pred, protos, n_classes, tile_size, conf=0.25, iou=0.7, max_det=300):
+    """
+    Raw YOLO-seg outputs -> detections, in numpy (same steps as ultralytics' NMS + process_mask with retina masks).
+    pred: (B, 4 + n_classes + n_mask_coeffs, anchors), protos: (B, n_mask_coeffs, mask_h, mask_w)
+    Returns (cls, masks, n_per_tile): classes (M,), 0/1 uint8 masks (M, tile_size, tile_size) and detections per tile.
+    """
+    all_cls, all_masks, n_per_tile = [], [], []
+    ys, xs = np.arange(tile_size)[:, None], np.arange(tile_size)[None, :]
+
+    for p, proto in zip(pred, protos):
+        p = p.T  # (anchors, 4 + n_classes + n_mask_coeffs)
+        scores = p[:, 4:4 + n_classes]
+        cls = scores.argmax(1)
+        confs = scores[np.arange(len(cls)), cls]
+
+        keep = confs > conf
+        p, cls, confs = p[keep], cls[keep], confs[keep]
+
+        # Per-class NMS on xywh (top-left) boxes
+        boxes = p[:, :4].copy()
+        boxes[:, :2] -= boxes[:, 2:] / 2
+        idx = cv2.dnn.NMSBoxesBatched(boxes.tolist(), confs.tolist(), cls.tolist(), conf, iou)
+        idx = np.asarray(idx, dtype=np.int64).reshape(-1)[:max_det]
+
+        n_per_tile.append(len(idx))
+        if len(idx) == 0:
+            continue
+
+        # Mask = sigmoid(coeffs @ protos), upsampled to the tile and cropped to its box
+        coeffs = p[idx, 4 + n_classes:]
+        mask_h, mask_w = proto.shape[1:]
+        masks = 1 / (1 + np.exp(-(coeffs @ proto.reshape(len(proto), -1)))).reshape(-1, mask_h, mask_w)
+        masks = np.stack([cv2.resize(m, (tile_size, tile_size), interpolation=cv2.INTER_LINEAR) for m in masks])
+
+        x1, y1, w, h = boxes[idx].T[:, :, None, None]
+        inside = (xs >= x1) & (xs < x1 + w) & (ys >= y1) & (ys < y1 + h)
+
+        all_cls.append(cls[idx])
+        all_masks.append(((masks > 0.5) & inside).astype(np.uint8))
+
+    if not all_cls:
+        return np.zeros(0, dtype=np.int64), None, n_per_tile
+    return np.concatenate(all_cls), np.concatenate(all_masks), n_per_tile
+
+
+class YoloExportedEngine:
+    """
+    YOLO segmentation model exported to ONNX (run with OnnxEngine) or OpenVINO, with a fixed tile_size x tile_size
+    input, so tiles are fed as-is (no letterboxing up to 640 px) in one batch. Warmed up at load time.
+    ONNX exports can run at a reduced `precision` (see quantize.py).
+    """
+
+    def __init__(self, weights_path, tile_size, n_classes, backend='onnx', conf=0.25, iou=0.7, providers=None,
+                 onnx_settings=None, precision='fp32'):
+        self.tile_size = tile_size
+        self.n_classes = n_classes
+        self.backend = backend
+        self.conf = conf
+        self.iou = iou
+        self.model_path = export_yolo(weights_path, tile_size, backend)
+        if precision != 'fp32':
+            if backend != 'onnx':
+                raise ValueError(f"precision {precision} is only available for the ONNX export")
+            from quantize import precision_model_path
+            self.model_path = precision_model_path(self.model_path, precision)
+
+        # Exported models take RGB, NCHW, float32 / 255
+        self.input_buffer = TileBatchBuffer(channels_first=True, flip_channels=True)
+
+        if backend == 'onnx':
+            from onnx_engine import OnnxEngine
+            self._onnx = OnnxEngine(self.model_path, providers or ['CPUExecutionProvider'], settings=onnx_settings,
+                                    warmup_shape=(1, 3, tile_size, tile_size))
+            self._run = self._onnx.run_batch_all
+        else:
+            import openvino as ov
+            core = ov.Core()
+            compiled = core.compile_model(core.read_model(self.model_path), 'CPU')
+            request = compiled.create_infer_request()
+            self._run = lambda batch: [request.infer({0: batch})[o] for o in compiled.outputs]
+            self._run(np.zeros((1, 3, tile_size, tile_size), dtype=np.float32))  # Warm-up
+
+    def _pad(self, tile):
+        # Captures smaller than a tile: pad (bottom/right, ultralytics' grey) up to the fixed input size
+        h, w = tile.shape[:2]
+        return cv2.copyMakeBorder(np.ascontiguousarray(tile), 0, self.tile_size - h, 0, self.tile_size - w,
+                                  cv2.BORDER_CONSTANT, value=(114, 114, 114))
+
+    def predict_tiles(self, slices):
+        """Returns (cls, masks, n_per_tile) for a list of uint8 BGR tiles (see decode_segmentation)"""
+        tile_h, tile_w = slices[0].shape[:2]
+        if (tile_h, tile_w) != (self.tile_size, self.tile_size):
+            slices = [self._pad(s) for s in slices]
+
+        pred, protos = self._run(self.input_buffer.fill(slices))[:2]
+        cls, masks, n_per_tile = decode_segmentation(pred, protos, self.n_classes, self.tile_size, self.conf, self.iou)
+
+        if masks is not None:
+            masks = np.ascontiguousarray(masks[:, :tile_h, :tile_w])
+        return cls, masks, n_per_tile